@@ -0,0 +1,314 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import queue
+import struct
+import sys
+import threading
+import time
+
+
+class AsyncLogger():
+
+    """Class for logging messages off the command and video threads.
+
+    Responsible for:
+        - putting structured log records into a bounded queue without ever
+          blocking the caller;
+        - per-message rate limiting;
+        - deduplication of repeated messages;
+        - writing records to the terminal from a background thread;
+        - writing high-frequency events to an optional compact binary file.
+
+    Binary event record format (little-endian):
+        timestamp - double, event id - unsigned short, number of values -
+        unsigned char, values - doubles.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, rate_limit_interval=0.5, binary_path=None,
+            queue_size=1024, stream=None):
+        # Records: ("msg", timestamp, tag, msg, suppressed) or
+        # ("event", timestamp, event_id, values).
+        self._records = queue.Queue(maxsize=queue_size)
+        self._dropped_count = 0
+        self._stream = stream or sys.stdout
+
+        # Rate limiting: minimum interval between messages with the same key.
+        self._rate_limit_interval = rate_limit_interval # s
+        # key: [last emitted timestamp, number of suppressed messages].
+        # Keys may contain error texts, so entries whose interval has passed
+        # are evicted once per interval.
+        self._rate_limits = {}
+        self._rate_limits_lock = threading.Lock()
+        self._last_eviction = 0
+
+        # Deduplication of consecutive identical messages.
+        self._last_message = None
+        self._repeat_count = 0
+
+        # Binary sink.
+        self._binary_path = binary_path
+        self._binary_file = None
+        if binary_path is not None:
+            self._binary_file = open(binary_path, "ab")
+
+        # Threads
+        self._writer_running = True
+        self._writer_thread = threading.Thread(target=self.write_records,
+            daemon=True)
+        self.writer_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def dropped_count(self):
+        return self._dropped_count
+
+    @property
+    def stream(self):
+        return self._stream
+
+    @property
+    def rate_limit_interval(self):
+        return self._rate_limit_interval
+
+    @property
+    def rate_limits(self):
+        return self._rate_limits
+
+    @property
+    def rate_limits_lock(self):
+        return self._rate_limits_lock
+
+    @property
+    def binary_path(self):
+        return self._binary_path
+
+    @property
+    def binary_file(self):
+        return self._binary_file
+
+    @property
+    def writer_running(self):
+        return self._writer_running
+
+    @property
+    def writer_thread(self):
+        return self._writer_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @dropped_count.setter
+    def dropped_count(self, new_dropped_count):
+        self._dropped_count = new_dropped_count
+
+    @writer_running.setter
+    def writer_running(self, new_writer_running):
+        self._writer_running = new_writer_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def log(self, tag, msg, key=None):
+
+        """Puts message into the log queue.
+
+        Never blocks: the message is dropped if it is rate limited or the
+        queue is full.
+
+        IN:
+            tag - str - message tag.
+            msg - str - message to be logged.
+            key - str - rate limiting key, messages with the same key are
+                logged at most once per rate_limit_interval. Not rate limited
+                if None.
+        """
+
+        timestamp = time.time()
+        suppressed = 0
+        if key is not None:
+            with self.rate_limits_lock:
+                if timestamp - self._last_eviction >= self.rate_limit_interval:
+                    self.evict_rate_limits(timestamp)
+                rate_limit = self.rate_limits.setdefault(key, [0, 0])
+                if timestamp - rate_limit[0] < self.rate_limit_interval:
+                    rate_limit[1] += 1
+                    return
+                suppressed = rate_limit[1]
+                self.rate_limits[key] = [timestamp, 0]
+
+        self.put_record(("msg", timestamp, tag, msg, suppressed))
+
+    def evict_rate_limits(self, timestamp):
+
+        """Drops rate limits whose interval has passed.
+
+        Counts of messages suppressed since the last one logged with an
+        evicted key are dropped with it. Must be called with
+        rate_limits_lock acquired.
+
+        IN:
+            timestamp - float - current time."""
+
+        for key in [key for key, rate_limit in self.rate_limits.items()
+                if timestamp - rate_limit[0] >= self.rate_limit_interval]:
+            del self.rate_limits[key]
+        self._last_eviction = timestamp
+
+    def log_event(self, event_id, *values):
+
+        """Puts high-frequency event into the binary sink queue.
+
+        Does nothing if there is no binary sink.
+
+        IN:
+            event_id - int - event identifier.
+            values - float - event values (at most 255)."""
+
+        if self.binary_file is None:
+            return
+        self.put_record(("event", time.time(), event_id, values))
+
+    def put_record(self, record):
+
+        """Puts record into the queue, drops it if the queue is full."""
+
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+
+    def write_records(self):
+
+        """Method for the background writer thread.
+
+        Writes records until stopped and the queue is drained."""
+
+        while self.writer_running or not self.records.empty():
+            try:
+                record = self.records.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                if record[0] == "msg":
+                    self.write_message(*record[1:])
+                else:
+                    self.write_event(*record[1:])
+            except Exception:
+                # Logging must never take the program down.
+                pass
+        self.flush_repeats()
+
+    def write_message(self, timestamp, tag, msg, suppressed):
+
+        """Writes message to the stream, collapsing consecutive repeats.
+
+        IN:
+            timestamp - float - record creation time.
+            tag - str - message tag.
+            msg - str - message.
+            suppressed - int - number of rate limited messages with the same
+                key since the last one logged."""
+
+        if (tag, msg) == self._last_message:
+            self._repeat_count += 1
+            return
+        self.flush_repeats()
+        self._last_message = (tag, msg)
+
+        if suppressed:
+            msg = "{} ({} similar messages suppressed)".format(msg, suppressed)
+        self.stream.write(tag + msg + "\n")
+        self.stream.flush()
+
+    def flush_repeats(self):
+
+        """Writes number of times the last message was repeated."""
+
+        if self._repeat_count:
+            tag = self._last_message[0]
+            self.stream.write("{}Last message repeated {} times\n".format(tag,
+                self._repeat_count))
+            self.stream.flush()
+        self._repeat_count = 0
+        self._last_message = None
+
+    def write_event(self, timestamp, event_id, values):
+
+        """Writes event record to the binary sink."""
+
+        self.binary_file.write(struct.pack("<dHB{}d".format(len(values)),
+            timestamp, event_id, len(values), *values))
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for draining the queue and stopping the writer thread."""
+
+        self.writer_running = False
+        self.writer_thread.join()
+        if self.binary_file is not None:
+            self.binary_file.close()
+        if self.dropped_count:
+            self.stream.write("Log records dropped: {}\n".format(
+                self.dropped_count))
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+def read_events(binary_path):
+
+    """Reads events written to the binary sink.
+
+    IN:
+        binary_path - str - binary sink file path.
+    OUT:
+        events - list - (timestamp, event_id, values) tuples.
+    """
+
+    events = []
+    header = struct.Struct("<dHB")
+    with open(binary_path, "rb") as binary_file:
+        data = binary_file.read()
+    offset = 0
+    while offset < len(data):
+        timestamp, event_id, num_of_values = header.unpack_from(data, offset)
+        offset += header.size
+        values = struct.unpack_from("<{}d".format(num_of_values), data, offset)
+        offset += 8 * num_of_values
+        events.append((timestamp, event_id, values))
+
+    return events
@@ -0,0 +1,341 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from haar_cascade_face_detector import DATA_DIR, HaarCascadeFaceDetector
+
+
+# Frames of the labeled clip set, loaded once per worker process.
+_worker_frames = None
+
+
+class CascadeTuner():
+
+    """Class for offline tuning of Haar Cascade detection parameters.
+
+    Responsible for:
+        - loading labeled frames from a clip set;
+        - evaluating recall, precision and per-frame latency of every
+          combination of scale_factor, min_neighbors, min_size and
+          input_scale in a pool of worker processes;
+        - finding the Pareto frontier of recall and precision against
+          latency;
+        - writing the chosen parameters to the file loaded by
+          HaarCascadeFaceDetector at startup.
+
+    Clip set labels file (JSON) format:
+        {"clips": [{"video": "clip.mp4",
+                    "frames": {"<frame index>": [[x, y, width, height], ...]}}]}
+    Video paths are relative to the labels file, bounding boxes are given in
+    full resolution pixels. Only labeled frames are evaluated; frames
+    labeled with an empty list have no face.
+
+    Like at runtime, only the first detection of a frame is scored: recall is
+    the share of frames with a face where it matches a labeled face, and
+    precision is the share of frames with a detection where it does. A false
+    first detection is followed by the drone, so it counts against precision.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, labels_path, num_of_workers=None):
+        self._labels_path = labels_path
+        self._num_of_workers = num_of_workers or os.cpu_count()
+
+        # Search space.
+        self._scale_factors = (1.05, 1.1, 1.2, 1.3, 1.4)
+        self._min_neighbors = (3, 4, 5, 6)
+        self._min_sizes = ((0, 0), (20, 20), (30, 30))
+        self._input_scales = (0.25, 0.5, 0.75, 1.0)
+
+        # Minimum intersection over union of a detected and a labeled
+        # bounding box to count the face as found.
+        self._min_iou = 0.5
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def labels_path(self):
+        return self._labels_path
+
+    @property
+    def num_of_workers(self):
+        return self._num_of_workers
+
+    @property
+    def scale_factors(self):
+        return self._scale_factors
+
+    @property
+    def min_neighbors(self):
+        return self._min_neighbors
+
+    @property
+    def min_sizes(self):
+        return self._min_sizes
+
+    @property
+    def input_scales(self):
+        return self._input_scales
+
+    @property
+    def min_iou(self):
+        return self._min_iou
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def load_frames(self):
+
+        """Loads labeled frames of the clip set in grayscale.
+
+        OUT:
+            frames - list - (img_gray, faces) tuples, faces - list of
+                [top_left_x, top_left_y, width, height] labels.
+        """
+
+        with open(self.labels_path) as labels_file:
+            labels = json.load(labels_file)
+        clips_dir = os.path.dirname(os.path.abspath(self.labels_path))
+
+        frames = []
+        for clip in labels["clips"]:
+            clip_frames = {int(i): faces for i, faces in clip["frames"].items()}
+            video_cap = cv2.VideoCapture(os.path.join(clips_dir, clip["video"]))
+            frame_index = 0
+            while frame_index <= max(clip_frames, default=-1):
+                frame_res, frame = video_cap.read()
+                if not frame_res:
+                    break
+                if frame_index in clip_frames:
+                    img_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    frames.append((img_gray, clip_frames[frame_index]))
+                frame_index += 1
+            video_cap.release()
+
+        return frames
+
+    def search_space(self):
+
+        """Returns all parameter combinations to be evaluated."""
+
+        return [{"scale_factor": scale_factor, "min_neighbors": min_neighbors,
+                 "min_size": min_size, "input_scale": input_scale}
+            for scale_factor, min_neighbors, min_size, input_scale
+            in itertools.product(self.scale_factors, self.min_neighbors,
+                self.min_sizes, self.input_scales)]
+
+    def run(self):
+
+        """Evaluates the whole search space in a pool of worker processes.
+
+        OUT:
+            results - list - parameters dicts extended with "recall",
+                "precision" and "latency_ms" (mean per frame) keys.
+        """
+
+        frames = self.load_frames()
+        with multiprocessing.Pool(self.num_of_workers,
+                initializer=_init_worker, initargs=(frames,)) as pool:
+            results = pool.starmap(_evaluate_params,
+                [(params, self.min_iou) for params in self.search_space()])
+
+        return results
+
+    def pareto_frontier(self, results):
+
+        """Finds results not dominated in recall, precision and latency.
+
+        IN:
+            results - list - results returned by run().
+        OUT:
+            frontier - list - non-dominated results sorted by latency.
+        """
+
+        frontier = []
+        for result in sorted(results, key=lambda r: (r["latency_ms"],
+                -r["recall"], -r["precision"])):
+            # Results before this one are at least as fast.
+            if not any(kept["recall"] >= result["recall"]
+                    and kept["precision"] >= result["precision"]
+                    for kept in frontier):
+                frontier.append(result)
+
+        return frontier
+
+    def choose_params(self, frontier, max_latency_ms):
+
+        """Chooses the result with the most correct first detections within
+        the latency budget.
+
+        Recall and precision are combined by F1 score, so parameters
+        trading many false detections for recall are not chosen.
+
+        IN:
+            frontier - list - Pareto frontier returned by pareto_frontier().
+            max_latency_ms - float - per frame latency budget.
+        OUT:
+            params - dict - chosen result, the fastest one if no result fits
+                the budget.
+        """
+
+        within_budget = [result for result in frontier
+            if result["latency_ms"] <= max_latency_ms]
+        if not within_budget:
+            return frontier[0]
+
+        return max(within_budget, key=lambda r: (_f1_score(r), r["recall"]))
+
+    def write_params(self, params, params_config):
+
+        """Writes detection parameters loaded by HaarCascadeFaceDetector.
+
+        Other parameters in the file (tiled mode) are kept.
+
+        IN:
+            params - dict - chosen result.
+            params_config - str - path to the parameters file."""
+
+        written_params = {}
+        if os.path.isfile(params_config):
+            with open(params_config) as params_file:
+                written_params.update(json.load(params_file))
+        keys = ("scale_factor", "min_neighbors", "min_size", "input_scale")
+        written_params.update({key: params[key] for key in keys})
+        with open(params_config, "w") as params_file:
+            json.dump(written_params, params_file, indent=4)
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+def _init_worker(frames):
+
+    """Stores labeled frames in a worker process."""
+
+    global _worker_frames
+    _worker_frames = frames
+
+
+def _evaluate_params(params, min_iou):
+
+    """Measures recall and precision of the first detection and mean per
+    frame latency of detection parameters.
+
+    IN:
+        params - dict - detection parameters.
+        min_iou - float - minimum intersection over union of a match.
+    OUT:
+        result - dict - params extended with "recall", "precision" and
+            "latency_ms".
+    """
+
+    detector = HaarCascadeFaceDetector(params_config=None, params=params)
+    scale = detector.input_scale
+
+    frames_with_face = 0
+    frames_with_detection = 0
+    correct_detections = 0
+    total_time = 0
+    for img_gray, labels in _worker_frames:
+        start_time = time.perf_counter()
+        height, width = img_gray.shape
+        img_scaled = cv2.resize(img_gray, (int(width*scale), int(height*scale)))
+        faces = detector.find_faces(img_scaled)
+        total_time += time.perf_counter() - start_time
+
+        frames_with_face += len(labels) > 0
+        if len(faces) == 0:
+            continue
+        frames_with_detection += 1
+        # Only the first detection is followed at runtime. Map it back to
+        # full resolution.
+        face = [int(value / scale) for value in faces[0]]
+        correct_detections += any(_iou(label, face) >= min_iou
+            for label in labels)
+
+    result = dict(params)
+    result["recall"] = (correct_detections / frames_with_face
+        if frames_with_face else 0)
+    result["precision"] = (correct_detections / frames_with_detection
+        if frames_with_detection else 0)
+    result["latency_ms"] = 1000 * total_time / max(1, len(_worker_frames))
+
+    return result
+
+
+def _f1_score(result):
+
+    """Calculates harmonic mean of result's recall and precision."""
+
+    recall, precision = result["recall"], result["precision"]
+    if recall + precision == 0:
+        return 0
+
+    return 2 * recall * precision / (recall + precision)
+
+
+def _iou(rect_a, rect_b):
+
+    """Calculates intersection over union of 2 [x, y, width, height] boxes."""
+
+    x_a, y_a, w_a, h_a = rect_a
+    x_b, y_b, w_b, h_b = rect_b
+    inter_w = min(x_a + w_a, x_b + w_b) - max(x_a, x_b)
+    inter_h = min(y_a + h_a, y_b + h_b) - max(y_a, y_b)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0
+    inter = inter_w * inter_h
+
+    return inter / (w_a * h_a + w_b * h_b - inter)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Tune Haar Cascade detection parameters on a labeled clip set.")
+    parser.add_argument("labels", help="clip set labels JSON file")
+    parser.add_argument("--max-latency-ms", type=float, default=20,
+        help="per frame detection latency budget")
+    parser.add_argument("--output",
+        default=os.path.join(DATA_DIR, "haar_cascade_params.json"),
+        help="parameters file loaded by HaarCascadeFaceDetector")
+    parser.add_argument("--workers", type=int, default=None,
+        help="number of worker processes (default: number of cores)")
+    args = parser.parse_args()
+
+    cascade_tuner = CascadeTuner(args.labels, args.workers)
+    frontier = cascade_tuner.pareto_frontier(cascade_tuner.run())
+
+    print("Pareto frontier (recall, precision / latency per frame):")
+    for result in frontier:
+        print("  recall: {:.3f}, precision: {:.3f}, latency: {:.2f} ms, "
+            "scale_factor: {}, min_neighbors: {}, min_size: {}, "
+            "input_scale: {}".format(result["recall"], result["precision"],
+            result["latency_ms"], result["scale_factor"],
+            result["min_neighbors"], result["min_size"], result["input_scale"]))
+
+    params = cascade_tuner.choose_params(frontier, args.max_latency_ms)
+    cascade_tuner.write_params(params, args.output)
+    print("Chosen parameters written to {}".format(args.output))
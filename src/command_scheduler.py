@@ -0,0 +1,322 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import threading
+import time
+
+
+class CommandScheduler():
+
+    """Class for scheduling control commands sent to Tello.
+
+    Responsible for:
+        - keeping one pending command slot per axis, so that a newer
+          correction replaces a pending one instead of queueing behind it;
+        - optionally merging pending up/down and forward/back moves into a
+          single "go x y z speed" command;
+        - dispatching axis commands round-robin, so that a correction of one
+          axis, recalculated after every response, cannot starve the others;
+        - dropping commands which were not sent before their deadline, counted
+          from the detection they were calculated from;
+        - keeping a preemptive high-priority lane for "land"/"emergency",
+          after which axis commands are rejected until resume().
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, merge_moves=False, command_ttl=1.0, go_speed=50):
+        # Axes, dispatched round-robin starting from _next_axis.
+        self._axes = ("x", "z", "y")
+        self._next_axis = 0
+        # Slot of every axis: (command, distance, deadline) or None.
+        self._slots = dict.fromkeys(self.axes)
+        # High-priority commands, dispatched before any axis slot.
+        self._priority_commands = ("land", "emergency")
+        self._priority_lane = []
+        # Set once "land"/"emergency" is submitted, axis commands are
+        # rejected then.
+        self._stopped = False
+
+        # Merging of up/down and forward/back moves into "go x y z speed".
+        self._merge_moves = merge_moves
+        self._go_speed = go_speed # cm/s
+        # Tello rejects "go" commands with all distances below 20 cm.
+        self._min_go_distance = 20 # cm
+        self._max_go_distance = 500 # cm
+
+        # Pending command lifetime.
+        self._command_ttl = command_ttl # s
+        self._expired_count = 0
+
+        self._lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def axes(self):
+        return self._axes
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def priority_commands(self):
+        return self._priority_commands
+
+    @property
+    def priority_lane(self):
+        return self._priority_lane
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    @property
+    def merge_moves(self):
+        return self._merge_moves
+
+    @property
+    def go_speed(self):
+        return self._go_speed
+
+    @property
+    def min_go_distance(self):
+        return self._min_go_distance
+
+    @property
+    def max_go_distance(self):
+        return self._max_go_distance
+
+    @property
+    def command_ttl(self):
+        return self._command_ttl
+
+    @property
+    def expired_count(self):
+        return self._expired_count
+
+    @property
+    def lock(self):
+        return self._lock
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @merge_moves.setter
+    def merge_moves(self, new_merge_moves):
+        self._merge_moves = new_merge_moves
+
+    @command_ttl.setter
+    def command_ttl(self, new_command_ttl):
+        self._command_ttl = new_command_ttl
+
+    @expired_count.setter
+    def expired_count(self, new_expired_count):
+        self._expired_count = new_expired_count
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def submit(self, axis, comm, ttl=None, timestamp=None):
+
+        """Puts command into the slot of the given axis.
+
+        Replaces a command that is still pending for the same axis.
+
+        IN:
+            axis - str - "x" (cw/ccw), "z" (up/down) or "y" (forward/back).
+            comm - str - command to be sent to Tello, e.g. "up 30".
+            ttl - float - command lifetime in seconds, command_ttl if None.
+            timestamp - float - time.monotonic() time of the detection the
+                command was calculated from, now if None. Commands
+                recalculated from the same detection keep its deadline.
+        OUT:
+            accepted - bool - False if rejected after "land"/"emergency".
+        """
+
+        if ttl is None:
+            ttl = self.command_ttl
+        if timestamp is None:
+            timestamp = time.monotonic()
+        direction, distance = comm.split()
+        with self.lock:
+            if self.stopped:
+                return False
+            self.slots[axis] = (direction, int(distance), timestamp + ttl)
+
+        return True
+
+    def cancel(self, axis):
+
+        """Drops pending command of the given axis.
+
+        Used when a newer detection shows that no correction is needed.
+
+        IN:
+            axis - str - axis whose slot is cleared."""
+
+        with self.lock:
+            self.slots[axis] = None
+
+    def submit_priority(self, comm):
+
+        """Puts command into the high-priority lane.
+
+        Pending axis commands are dropped and new ones rejected, as they
+        must not be executed after "land"/"emergency".
+
+        IN:
+            comm - str - "land" or "emergency"."""
+
+        with self.lock:
+            self.priority_lane.append(comm)
+            self._stopped = True
+            for axis in self.axes:
+                self.slots[axis] = None
+
+    def resume(self):
+
+        """Accepts axis commands again, e.g. after a new takeoff."""
+
+        with self.lock:
+            self._stopped = False
+
+    def has_priority(self):
+
+        """Checks if there is a command in the high-priority lane."""
+
+        with self.lock:
+            return len(self.priority_lane) > 0
+
+    def is_empty(self):
+
+        """Checks if there are no commands to be sent."""
+
+        with self.lock:
+            self.drop_expired()
+            return (len(self.priority_lane) == 0
+                and all(slot is None for slot in self.slots.values()))
+
+    def depth(self):
+
+        """Returns number of commands waiting to be sent."""
+
+        with self.lock:
+            return (len(self.priority_lane)
+                + sum(slot is not None for slot in self.slots.values()))
+
+    def next_command(self):
+
+        """Takes next command to be sent to Tello.
+
+        OUT:
+            comm - str - command to be sent, None if there is nothing to send.
+        """
+
+        with self.lock:
+            if self.priority_lane:
+                return self.priority_lane.pop(0)
+
+            self.drop_expired()
+
+            if self.merge_moves:
+                go_comm = self.merge_go_command()
+                if go_comm is not None:
+                    return go_comm
+
+            for i in range(len(self.axes)):
+                axis_index = (self._next_axis + i) % len(self.axes)
+                slot = self.slots[self.axes[axis_index]]
+                if slot is not None:
+                    self.slots[self.axes[axis_index]] = None
+                    self._next_axis = (axis_index + 1) % len(self.axes)
+                    return "{} {}".format(slot[0], slot[1])
+
+    def drop_expired(self):
+
+        """Drops axis commands whose deadline has passed.
+
+        Must be called with lock acquired."""
+
+        now = time.monotonic()
+        for axis in self.axes:
+            slot = self.slots[axis]
+            if slot is not None and slot[2] < now:
+                self.slots[axis] = None
+                self.expired_count += 1
+
+    def merge_go_command(self):
+
+        """Merges pending up/down and forward/back moves into "go" command.
+
+        Yaw has no equivalent in "go" command, so X axis slot stays pending.
+        Must be called with lock acquired.
+
+        OUT:
+            go_comm - str - "go x y z speed" command, None if there is less
+                than 2 moves to merge.
+        """
+
+        z_slot, y_slot = self.slots["z"], self.slots["y"]
+        if z_slot is None or y_slot is None:
+            return
+
+        # Tello "go" frame: x - forward, y - left, z - up.
+        go_x = y_slot[1] if y_slot[0] == "forward" else -y_slot[1]
+        go_z = z_slot[1] if z_slot[0] == "up" else -z_slot[1]
+        go_x = max(-self.max_go_distance, min(self.max_go_distance, go_x))
+        go_z = max(-self.max_go_distance, min(self.max_go_distance, go_z))
+        if max(abs(go_x), abs(go_z)) < self.min_go_distance:
+            return
+
+        self.slots["z"] = None
+        self.slots["y"] = None
+        self._next_axis = self.axes.index("x")
+        return "go {} 0 {} {}".format(go_x, go_z, self.go_speed)
+
+    def clear(self):
+
+        """Drops all pending commands."""
+
+        with self.lock:
+            self.priority_lane.clear()
+            for axis in self.axes:
+                self.slots[axis] = None
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    # For testing purposes.
+
+    command_scheduler = CommandScheduler(merge_moves=True)
+
+    command_scheduler.submit("x", "cw 20")
+    command_scheduler.submit("z", "up 30")
+    command_scheduler.submit("z", "down 25")
+    command_scheduler.submit("y", "forward 40")
+    command_scheduler.submit_priority("land")
+    command_scheduler.submit("x", "ccw 10")
+
+    while not command_scheduler.is_empty():
+        print(command_scheduler.next_command())
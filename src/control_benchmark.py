@@ -0,0 +1,549 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import argparse
+import math
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from follow_me import Tello
+from fuzzy_logic_controller import FuzzyLogicController
+
+
+class BenchmarkTello(Tello):
+
+    """Tello with the follow-me control law only: no sockets, threads,
+    video or logging.
+
+    handle_commands() runs unchanged; the command it would send to Tello is
+    kept in sent_command instead.
+    """
+
+    def __init__(self, frame_shape=(360, 480), input_scale=0.5):
+        self.init_movement_control()
+        # Only frame shape and detector input scale are used by the control
+        # law.
+        self._frame = np.empty(frame_shape + (0,), np.uint8)
+        self._face_rect = None
+        self._face_rect_time = None
+        self._haar_face_detector = SimpleNamespace(input_scale=input_scale)
+        self._info_tag = "TELLO_BENCHMARK_INFO: "
+        self._err_tag = "TELLO_BENCHMARK_ERR: "
+        self.sent_command = None
+
+    def send_command(self, comm):
+
+        """Keeps command instead of sending it to Tello."""
+
+        self.sent_command = comm
+
+    def log_message(self, tag, msg, key=None):
+
+        """Drops log messages, logging would dominate benchmark time."""
+
+
+class FuzzyBenchmarkTello(BenchmarkTello):
+
+    """BenchmarkTello turning and climbing by FuzzyLogicController."""
+
+    def __init__(self, frame_shape=(360, 480), input_scale=0.5):
+        super().__init__(frame_shape, input_scale)
+        self.fuzzy_logic_controller = FuzzyLogicController()
+
+    def calculate_x_command(self):
+
+        """Determines turn degrees by fuzzy logic."""
+
+        x_center_diff = (self.frame.shape[1] // 2
+            - (self.face_rect[0] + self.face_rect[2] // 2))
+        turn_degrees = self.fuzzy_logic_controller.calculate_x(min(
+            abs(x_center_diff), self.fuzzy_logic_controller.x_in_max_val))
+        if turn_degrees > self.x_threshold:
+            direction = "ccw" if x_center_diff > 0 else "cw"
+            self.command_scheduler.submit("x", "{} {}".format(direction,
+                turn_degrees))
+        else:
+            self.command_scheduler.cancel("x")
+
+    def calculate_z_command(self):
+
+        """Determines up/down movement distance by fuzzy logic."""
+
+        z_center_diff = (self.face_rect[1] + self.face_rect[3] // 2
+            - self.frame.shape[0] // 2)
+        distance = self.fuzzy_logic_controller.calculate_z(min(
+            abs(z_center_diff), self.fuzzy_logic_controller.z_in_max_val))
+        if distance > self.z_threshold:
+            direction = "down" if z_center_diff > 0 else "up"
+            self.command_scheduler.submit("z", "{} {}".format(direction,
+                distance))
+        else:
+            self.command_scheduler.cancel("z")
+
+
+class DroneKinematics():
+
+    """Class for simulating Tello pose under SDK movement commands.
+
+    Movements run at constant speed and rotations at constant rate, like
+    TelloSimulator; Tello answers (and takes the next command) when the
+    movement is finished. Camera is a pinhole camera looking forward.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, frame_shape=(360, 480), horizontal_fov=82.6,
+            face_size=19, speed=100, yaw_rate=90):
+        # Pose: position (cm), height (cm), yaw (deg, clockwise).
+        self.x = 0
+        self.y = 0
+        self.height = 150
+        self.yaw = 0
+
+        # Motion of the executed command.
+        self._velocity = (0, 0, 0) # forward, left, up in cm/s
+        self._yaw_velocity = 0 # deg/s
+        self._speed = speed # cm/s
+        self._yaw_rate = yaw_rate # deg/s
+
+        # Camera
+        self._frame_height, self._frame_width = frame_shape
+        self._focal_length = (self._frame_width / 2
+            / math.tan(math.radians(horizontal_fov / 2))) # px
+        self._face_size = face_size # cm
+        # Smaller faces are not detected.
+        self._min_face_size = 20 # px
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def start(self, comm):
+
+        """Starts executing SDK command.
+
+        IN:
+            comm - str - SDK command.
+        OUT:
+            duration - float - execution time in seconds.
+        """
+
+        name, *args = comm.split()
+        args = [int(arg) for arg in args]
+        self._velocity = (0, 0, 0)
+        self._yaw_velocity = 0
+
+        if name in ("cw", "ccw"):
+            self._yaw_velocity = self._yaw_rate if name == "cw" else -self._yaw_rate
+            return args[0] / self._yaw_rate
+        if name == "go":
+            forward, left, up, speed = args
+        else:
+            forward = {"forward": 1, "back": -1}.get(name, 0) * args[0]
+            left = {"left": 1, "right": -1}.get(name, 0) * args[0]
+            up = {"up": 1, "down": -1}.get(name, 0) * args[0]
+            speed = self._speed
+        distance = math.sqrt(forward**2 + left**2 + up**2)
+        if distance == 0:
+            return 0
+        self._velocity = tuple(value / distance * speed
+            for value in (forward, left, up))
+
+        return distance / speed
+
+    def stop(self):
+
+        """Stops movement."""
+
+        self._velocity = (0, 0, 0)
+        self._yaw_velocity = 0
+
+    def step(self, dt):
+
+        """Advances pose by dt seconds of the current movement."""
+
+        forward, left, up = self._velocity
+        if forward or left:
+            theta = -math.radians(self.yaw)
+            self.x += dt * (forward*math.cos(theta) - left*math.sin(theta))
+            self.y += dt * (forward*math.sin(theta) + left*math.cos(theta))
+        self.height += dt * up
+        self.yaw += dt * self._yaw_velocity
+
+    def relative(self, target):
+
+        """Returns target position in drone coordinates.
+
+        IN:
+            target - tuple - (x, y, height) of the face in cm.
+        OUT:
+            (forward, left, up) - tuple - in cm.
+        """
+
+        dx = target[0] - self.x
+        dy = target[1] - self.y
+        theta = -math.radians(self.yaw)
+        forward = dx*math.cos(theta) + dy*math.sin(theta)
+        left = -dx*math.sin(theta) + dy*math.cos(theta)
+
+        return forward, left, target[2] - self.height
+
+    def render_face(self, target):
+
+        """Projects the face onto the camera frame.
+
+        IN:
+            target - tuple - (x, y, height) of the face in cm.
+        OUT:
+            face_rect - list - [top_left_x, top_left_y, width, height], None
+                if the face is not fully in view or too small to detect.
+        """
+
+        forward, left, up = self.relative(target)
+        if forward <= 0:
+            return
+        size = int(self._focal_length * self._face_size / forward)
+        center_x = self._frame_width/2 - self._focal_length*left/forward
+        center_y = self._frame_height/2 - self._focal_length*up/forward
+        face_x = int(center_x - size/2)
+        face_y = int(center_y - size/2)
+        if (size < self._min_face_size or face_x < 0 or face_y < 0
+                or face_x + size > self._frame_width
+                or face_y + size > self._frame_height):
+            return
+
+        return [face_x, face_y, size, size]
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+class ControlBenchmark():
+
+    """Class for benchmarking follow-me control law in closed loop.
+
+    Every episode places the drone at the target distance from a face moving
+    along a scripted trajectory. The control loop renders the face bounding
+    box from the simulated pose, lets the control law calculate the next
+    command and executes it in DroneKinematics, in simulated time. Yaw,
+    height and distance errors are sampled every dt seconds.
+
+    Reported per trajectory:
+        - settling time - time after which all errors stay within their
+          bands, unsettled episodes are counted separately;
+        - overshoot - largest error past the target, relative to the initial
+          error of the axis, for axes starting outside their band;
+        - commands - number of sent commands;
+        - tracking error - RMS error of every axis;
+        - face lost - fraction of time the face was out of view.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, controller="proportional", merge_moves=False,
+            duration=20, dt=0.05, command_latency=0.1, seed=0):
+        self._controller = controller
+        self._merge_moves = merge_moves
+        self._duration = duration # s
+        self._dt = dt # s
+        # Time from the end of a movement to the start of the next one:
+        # response, detection and command transfer.
+        self._command_latency = command_latency # s
+        self._random = random.Random(seed)
+
+        # Error bands: (yaw deg, height cm, distance cm).
+        self._bands = (10, 25, 25)
+        self._target_distance = 80 # cm
+
+        self._trajectories = {
+            "step_side": self.step_side,
+            "step_far": self.step_far,
+            "step_up": self.step_up,
+            "walk_around": self.walk_around,
+            "walk_away": self.walk_away,
+        }
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def controller(self):
+        return self._controller
+
+    @property
+    def merge_moves(self):
+        return self._merge_moves
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def dt(self):
+        return self._dt
+
+    @property
+    def command_latency(self):
+        return self._command_latency
+
+    @property
+    def bands(self):
+        return self._bands
+
+    @property
+    def target_distance(self):
+        return self._target_distance
+
+    @property
+    def trajectories(self):
+        return self._trajectories
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Trajectories
+    #--------------------------------------------------------------------------
+
+    # Every trajectory takes random generator and returns a function of time
+    # giving face (x, y, height) in cm. The drone starts at (0, 0, 150)
+    # facing +x.
+
+    def step_side(self, rng):
+
+        """Face standing aside, at 15-35 degrees."""
+
+        angle = math.radians(rng.choice((-1, 1)) * rng.uniform(15, 35))
+        target = (self.target_distance*math.cos(angle),
+            self.target_distance*math.sin(angle), 150)
+        return lambda t: target
+
+    def step_far(self, rng):
+
+        """Face standing 40-100 cm farther than the target distance."""
+
+        target = (self.target_distance + rng.uniform(40, 100), 0, 150)
+        return lambda t: target
+
+    def step_up(self, rng):
+
+        """Face standing 20-40 cm above or below the drone."""
+
+        target = (self.target_distance, 0,
+            150 + rng.choice((-1, 1)) * rng.uniform(20, 40))
+        return lambda t: target
+
+    def walk_around(self, rng):
+
+        """Face walking around the drone at 20-40 cm/s."""
+
+        angular_speed = rng.choice((-1, 1)) * rng.uniform(20, 40) / self.target_distance
+        return lambda t: (self.target_distance*math.cos(angular_speed*t),
+            self.target_distance*math.sin(angular_speed*t), 150)
+
+    def walk_away(self, rng):
+
+        """Face walking away at 10-30 cm/s, swaying sideways."""
+
+        speed = rng.uniform(10, 30)
+        return lambda t: (self.target_distance + speed*t,
+            20*math.sin(0.5*t), 150)
+
+    #--------------------------------------------------------------------------
+    # End Trajectories
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def create_tello(self):
+
+        """Creates control law under test."""
+
+        if self.controller == "fuzzy":
+            tello = FuzzyBenchmarkTello()
+        else:
+            tello = BenchmarkTello()
+        tello.command_scheduler.merge_moves = self.merge_moves
+        return tello
+
+    def errors(self, drone, target):
+
+        """Returns (yaw, height, distance) errors of the drone."""
+
+        forward, left, up = drone.relative(target)
+        yaw_error = math.degrees(math.atan2(left, forward))
+        distance_error = math.hypot(forward, left) - self.target_distance
+
+        return yaw_error, up, distance_error
+
+    def run_episode(self, trajectory):
+
+        """Runs one closed loop episode.
+
+        IN:
+            trajectory - callable - face position as a function of time.
+        OUT:
+            result - dict - episode metrics.
+        """
+
+        tello = self.create_tello()
+        drone = DroneKinematics()
+        t = 0
+        num_of_commands = 0
+        lost_samples = 0
+        samples = []
+
+        def advance(duration):
+            nonlocal t, lost_samples
+            end_time = min(t + duration, self.duration)
+            while t < end_time:
+                step = min(self.dt, end_time - t)
+                drone.step(step)
+                t += step
+                target = trajectory(t)
+                samples.append((t, self.errors(drone, target)))
+                if drone.render_face(target) is None:
+                    lost_samples += 1
+
+        samples.append((0, self.errors(drone, trajectory(0))))
+        while t < self.duration:
+            face_rect = drone.render_face(trajectory(t))
+            # Like Tello, keep the last face when detection misses.
+            if face_rect is not None:
+                tello.face_rect = face_rect
+            if tello.face_rect is None:
+                advance(self.dt)
+                continue
+
+            tello.sent_command = None
+            tello.handle_commands()
+            if tello.sent_command is None:
+                # No correction needed, wait for the next frame.
+                advance(self.dt)
+                continue
+            num_of_commands += 1
+            advance(drone.start(tello.sent_command))
+            drone.stop()
+            advance(self.command_latency)
+
+        return self.episode_metrics(samples, num_of_commands, lost_samples)
+
+    def episode_metrics(self, samples, num_of_commands, lost_samples):
+
+        """Calculates episode metrics from error samples."""
+
+        settling_time = 0
+        for t, errors in samples:
+            if any(abs(error) > band for error, band in zip(errors, self.bands)):
+                settling_time = t
+        settled = settling_time < samples[-1][0]
+
+        overshoots = []
+        initial_errors = samples[0][1]
+        for axis, (initial_error, band) in enumerate(zip(initial_errors,
+                self.bands)):
+            if abs(initial_error) > band:
+                past_target = max(-math.copysign(1, initial_error) * errors[axis]
+                    for _, errors in samples)
+                overshoots.append(max(0, past_target) / abs(initial_error))
+
+        rms_errors = tuple(math.sqrt(sum(errors[axis]**2 for _, errors in samples)
+            / len(samples)) for axis in range(3))
+
+        return {"settled": settled, "settling_time": settling_time,
+            "overshoot": max(overshoots) if overshoots else None,
+            "commands": num_of_commands, "rms_errors": rms_errors,
+            "lost": lost_samples / max(1, len(samples) - 1)}
+
+    def run(self, num_of_episodes):
+
+        """Runs episodes on every trajectory.
+
+        IN:
+            num_of_episodes - int - number of episodes per trajectory.
+        OUT:
+            results - dict - trajectory name: list of episode metrics.
+        """
+
+        results = {}
+        for name, trajectory in self.trajectories.items():
+            results[name] = [self.run_episode(trajectory(self._random))
+                for _ in range(num_of_episodes)]
+
+        return results
+
+    def report(self, results):
+
+        """Returns summary of episode results as text."""
+
+        lines = ["{:<12} {:>9} {:>10} {:>10} {:>9} {:>22} {:>6}".format(
+            "trajectory", "settled", "settle s", "overshoot", "commands",
+            "rms yaw/h/dist", "lost")]
+        for name, episodes in results.items():
+            settled = [episode for episode in episodes if episode["settled"]]
+            overshoots = [episode["overshoot"] for episode in episodes
+                if episode["overshoot"] is not None]
+            rms_errors = [sum(episode["rms_errors"][axis] for episode in episodes)
+                / len(episodes) for axis in range(3)]
+            lines.append("{:<12} {:>8.0f}% {:>10} {:>10} {:>9.1f} {:>22} "
+                "{:>5.0f}%".format(name,
+                100 * len(settled) / len(episodes),
+                "{:.2f}".format(sum(episode["settling_time"] for episode in settled)
+                    / len(settled)) if settled else "-",
+                "{:.0f}%".format(100 * sum(overshoots) / len(overshoots))
+                    if overshoots else "-",
+                sum(episode["commands"] for episode in episodes) / len(episodes),
+                "{:.1f}/{:.1f}/{:.1f}".format(*rms_errors),
+                100 * sum(episode["lost"] for episode in episodes) / len(episodes)))
+
+        return "\n".join(lines)
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark follow-me control law in closed loop.")
+    parser.add_argument("--controller", choices=("proportional", "fuzzy"),
+        default="proportional", help="control law for turning and climbing")
+    parser.add_argument("--merge-moves", action="store_true",
+        help="merge up/down and forward/back into go commands")
+    parser.add_argument("--episodes", type=int, default=200,
+        help="episodes per trajectory")
+    parser.add_argument("--duration", type=float, default=20,
+        help="simulated seconds per episode")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    control_benchmark = ControlBenchmark(args.controller, args.merge_moves,
+        args.duration, seed=args.seed)
+    start_time = time.perf_counter()
+    results = control_benchmark.run(args.episodes)
+    elapsed = time.perf_counter() - start_time
+
+    print(control_benchmark.report(results))
+    num_of_episodes = sum(len(episodes) for episodes in results.values())
+    print("{} episodes in {:.1f} s ({:.0f} episodes/min).".format(
+        num_of_episodes, elapsed, 60 * num_of_episodes / elapsed))
@@ -0,0 +1,237 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import collections
+import os
+import threading
+import time
+
+from haar_cascade_face_detector import HaarCascadeFaceDetector
+
+
+class DetectorPool():
+
+    """Class for sharing face detection workers between video streams.
+
+    Responsible for:
+        - running a pool of detection threads sized to the number of cores
+          (OpenCV releases the GIL while detecting);
+        - keeping only the latest frame of every stream, so that a stream
+          never waits behind its own stale frames;
+        - round-robin scheduling of streams with at most 1 frame of a stream
+          in detection at a time, so that one busy stream cannot starve the
+          others.
+
+    Every worker has its own HaarCascadeFaceDetector, as cascade classifiers
+    are not shared between threads.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, num_of_workers=None, detector_params=None):
+        self._num_of_workers = num_of_workers or os.cpu_count() or 1
+        # Parameters overriding the detectors' parameters file.
+        self._detector_params = detector_params
+        # Detector used by clients for detection parameters (input_scale).
+        self._detector = HaarCascadeFaceDetector(params=detector_params)
+
+        # stream_id: callback(frame, detected_face, detection_time).
+        self._callbacks = {}
+        # stream_id: latest frame waiting for detection.
+        self._pending_frames = {}
+        # Streams with a pending frame, in the order they are served.
+        self._ready_streams = collections.deque()
+        # Streams whose frame is being detected.
+        self._busy_streams = set()
+        # stream_id: number of frames replaced before detection.
+        self._dropped_counts = collections.Counter()
+        # stream_id: number of failed detections.
+        self._error_counts = collections.Counter()
+        self._condition = threading.Condition()
+
+        # Threads
+        self._workers_running = True
+        self._worker_threads = [threading.Thread(target=self.detect_worker,
+            daemon=True) for _ in range(self.num_of_workers)]
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def num_of_workers(self):
+        return self._num_of_workers
+
+    @property
+    def detector(self):
+        return self._detector
+
+    @property
+    def callbacks(self):
+        return self._callbacks
+
+    @property
+    def pending_frames(self):
+        return self._pending_frames
+
+    @property
+    def ready_streams(self):
+        return self._ready_streams
+
+    @property
+    def busy_streams(self):
+        return self._busy_streams
+
+    @property
+    def dropped_counts(self):
+        return self._dropped_counts
+
+    @property
+    def error_counts(self):
+        return self._error_counts
+
+    @property
+    def condition(self):
+        return self._condition
+
+    @property
+    def workers_running(self):
+        return self._workers_running
+
+    @property
+    def worker_threads(self):
+        return self._worker_threads
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @workers_running.setter
+    def workers_running(self, new_workers_running):
+        self._workers_running = new_workers_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def register(self, stream_id, callback):
+
+        """Registers video stream.
+
+        IN:
+            stream_id - str - stream identifier.
+            callback - callable - called from a worker thread with (frame,
+                detected_face, detection_time) after every detection,
+                detected_face as returned by
+                HaarCascadeFaceDetector.detect_face(), detection_time in
+                seconds."""
+
+        with self.condition:
+            self.callbacks[stream_id] = callback
+
+    def unregister(self, stream_id):
+
+        """Unregisters video stream and drops its pending frame."""
+
+        with self.condition:
+            self.callbacks.pop(stream_id, None)
+            self.pending_frames.pop(stream_id, None)
+            if stream_id in self.ready_streams:
+                self.ready_streams.remove(stream_id)
+
+    def submit(self, stream_id, frame):
+
+        """Submits frame for detection, replacing a pending one.
+
+        Never blocks.
+
+        IN:
+            stream_id - str - registered stream identifier.
+            frame - numpy.ndarray - frame to be analyzed."""
+
+        with self.condition:
+            if stream_id in self.pending_frames:
+                self.dropped_counts[stream_id] += 1
+            elif stream_id not in self.busy_streams:
+                self.ready_streams.append(stream_id)
+            self.pending_frames[stream_id] = frame
+            self.condition.notify()
+
+    def detect_worker(self):
+
+        """Method for detection worker thread.
+
+        Takes the latest frame of the next ready stream, detects face and
+        passes the result to the stream's callback."""
+
+        detector = HaarCascadeFaceDetector(params=self._detector_params)
+        while True:
+            with self.condition:
+                while self.workers_running and not self.ready_streams:
+                    self.condition.wait()
+                if not self.workers_running:
+                    detector.terminate()
+                    return
+                stream_id = self.ready_streams.popleft()
+                frame = self.pending_frames.pop(stream_id)
+                callback = self.callbacks.get(stream_id)
+                self.busy_streams.add(stream_id)
+
+            detection_start = time.perf_counter()
+            try:
+                detected_face = detector.detect_face(frame)
+            except Exception:
+                detected_face = None
+                self.error_counts[stream_id] += 1
+            try:
+                if callback is not None:
+                    callback(frame, detected_face,
+                        time.perf_counter() - detection_start)
+            except Exception:
+                # Callbacks handle their own errors, a worker must survive.
+                self.error_counts[stream_id] += 1
+            finally:
+                with self.condition:
+                    self.busy_streams.discard(stream_id)
+                    # Frame submitted while detecting goes to the back.
+                    if stream_id in self.pending_frames:
+                        self.ready_streams.append(stream_id)
+                        self.condition.notify()
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for terminating detection worker threads."""
+
+        with self.condition:
+            self.workers_running = False
+            self.condition.notify_all()
+        for worker_thread in self.worker_threads:
+            worker_thread.join()
+        self.detector.terminate()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
@@ -6,7 +6,17 @@ import threading
 import datetime
 import time
 
+from async_logger import AsyncLogger
+from command_scheduler import CommandScheduler
+from frame_bus import FrameBus
 from haar_cascade_face_detector import HaarCascadeFaceDetector
+from metrics import MetricsRegistry
+from motion_gate import MotionGate
+from offload_detection import OffloadDetectionClient
+from startup_sequencer import StartupSequencer
+from tello_state_receiver import TelloStateReceiver
+from video_ingest import LazyFrame, VideoIngest
+from video_recorder import VideoRecorder
 
 
 class Tello():
@@ -26,43 +36,159 @@ class Tello():
     # Init
     #--------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self, logger=None, metrics=None, name=None,
+            tello_ip="192.168.10.1", mac_ip="0.0.0.0", comm_receive_port=9003,
+            tello_state_port=8890, video_receive_port=11111, video_url=None,
+            detector_pool=None, motion_gating=True, frame_bus_name=None,
+            record_dir=None, offload_address=None, luma_only=False,
+            merge_moves=False, binary_log_path=None, face_detector=None,
+            skip_late_frames=True, detector_params=None):
+        # Name distinguishing drones controlled from one process.
+        self._name = name
         # Communication
         # IPs
-        self._tello_ip = "192.168.10.1"
-        self._mac_ip = "0.0.0.0"
+        self._tello_ip = tello_ip
+        self._mac_ip = mac_ip
         # Ports
         self._comm_send_port = 8889
-        self._tello_state_port = 8890
-        self._video_receive_port = 11111
-        self._comm_receive_port = 9003
+        self._tello_state_port = tello_state_port
+        self._video_receive_port = video_receive_port
+        self._comm_receive_port = comm_receive_port
+        # Video stream, Tello UDP stream unless a file/camera is given.
+        if video_url is None:
+            video_url = "udp://@{}:{}".format(self.mac_ip, self.video_receive_port)
+        self._video_url = video_url
+        # Detection reads the decoded luma plane, BGR is converted only for
+        # displayed and recorded frames (requires PyAV).
+        self._luma_only = luma_only
+        # Decoding skips frames while behind real time (requires PyAV).
+        self._skip_late_frames = skip_late_frames
         # Sockets
         self._comm_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.comm_sock.bind((self.mac_ip, self.comm_receive_port))
         self.comm_sock.settimeout(1)
 
         # Face detection
-        self._haar_face_detector = HaarCascadeFaceDetector()
+        # Detector is loaded in the background during startup sequence.
+        # With a detector pool, detection runs on the pool's workers.
+        self._detector_pool = detector_pool
+        self._haar_face_detector = None
+        # Detector used instead of HaarCascadeFaceDetector, if given (e.g. a
+        # scripted one in soak tests).
+        self._face_detector = face_detector
+        # Parameters overriding the detector's parameters file (e.g. tiled
+        # mode), ignored with a detector pool.
+        self._detector_params = detector_params
+        # Skips detection while the region around the face is unchanged.
+        self._motion_gate = MotionGate() if motion_gating else None
+        self._detector_loaded = threading.Event()
         self._frame = None
         self._face_rect = None
+        # time.monotonic() time of the frame face_rect was detected in.
+        self._face_rect_time = None
+        # Detection runs on a remote DetectionServer ("host:port"), if
+        # offload_address is given, and locally while its replies are late.
+        self._offload_client = None
+        if offload_address is not None:
+            self._offload_client = OffloadDetectionClient(offload_address)
+        self._offload_lagging = False
+        # Index of the last frame sent to detection and of the last frame
+        # with detection results, to skip results older than shown ones.
+        self._offload_frame_index = 0
+        self._detected_frame_index = 0
+        # Decoded frames are published to other processes through shared
+        # memory, if frame_bus_name is given. Created with the first frame.
+        self._frame_bus_name = frame_bus_name
+        self._frame_bus = None
+        # Annotated frames are recorded in the background, if record_dir is
+        # given.
+        self._video_recorder = None
+        if record_dir is not None:
+            prefix = "tello" if name is None else "tello_{}".format(name)
+            self._video_recorder = VideoRecorder(record_dir, prefix=prefix,
+                on_error=lambda msg: self.log_message(self.err_tag, msg,
+                    key=self.err_tag + "record"))
 
         # Logging
         self._info_tag = "TELLO_INFO: "
         self._err_tag = "TELLO_ERR: "
+        if name is not None:
+            self._info_tag = "TELLO_INFO [{}]: ".format(name)
+            self._err_tag = "TELLO_ERR [{}]: ".format(name)
+        # High-frequency events (detected faces) are written to
+        # binary_log_path, if Tello creates its own logger.
+        self._owns_logger = logger is None
+        self._logger = logger
+        if logger is None:
+            self._logger = AsyncLogger(binary_path=binary_log_path)
+        # Binary log event ids.
+        self._face_event_id = 1
 
         # Movement control
-        # X axis
-        self._x_threshold = 5 # deg
-        self._max_turn_degrees = 41 # deg
-        # Z axis
-        self._z_threshold = 20 # cm
-        self._max_z_distance = 50 # cm
-        # Y axis
-        self._y_threshold = 20 # cm
-        self._target_face_height = 65 # px
-        self._target_y_distance = 80 # cm
-        
-        self._command_queue = []
+        # Up/down and forward/back moves are merged into "go" commands, if
+        # merge_moves is True.
+        self.init_movement_control(merge_moves)
+
+        # Metrics
+        self._metrics = metrics if metrics is not None else MetricsRegistry()
+        self._metrics_labels = {"drone": name} if name is not None else {}
+        self._frames_captured = self.metrics.counter(
+            "tello_frames_captured_total", "Video frames decoded.",
+            self.metrics_labels)
+        self._frames_dropped = self.metrics.counter(
+            "tello_frames_dropped_total", "Video reads that returned no frame.",
+            self.metrics_labels)
+        self._capture_fps = self.metrics.gauge("tello_capture_fps",
+            "Video capture rate, exponentially smoothed.", self.metrics_labels)
+        self._detection_latency = self.metrics.histogram(
+            "tello_detection_latency_seconds", "Face detection time per frame.",
+            self.metrics_labels)
+        self._detections = self.metrics.counter("tello_detections_total",
+            "Frames passed to face detection.", self.metrics_labels)
+        self._detection_hits = self.metrics.counter(
+            "tello_detection_hits_total", "Frames with a detected face.",
+            self.metrics_labels)
+        self._detections_skipped = self.metrics.counter(
+            "tello_detections_skipped_total",
+            "Frames reusing the previous face, as it did not move.",
+            self.metrics_labels)
+        self._command_rtt = self.metrics.histogram("tello_command_rtt_seconds",
+            "Time from sending a command to receiving its response.",
+            self.metrics_labels)
+        if self.offload_client is not None:
+            self._offload_requests = self.metrics.counter(
+                "tello_offload_requests_total",
+                "Frames sent to the detection server.", self.metrics_labels)
+            self._offload_fallbacks = self.metrics.counter(
+                "tello_offload_fallbacks_total",
+                "Frames detected locally as detection server replies were "
+                "late.", self.metrics_labels)
+            self.metrics.gauge("tello_offload_late_replies",
+                "Detection server requests expired without reply.",
+                self.metrics_labels,
+                function=lambda: self.offload_client.late_count)
+            self.metrics.gauge("tello_offload_superseded_requests",
+                "Detection server requests replaced by newer ones before "
+                "detection.", self.metrics_labels,
+                function=lambda: self.offload_client.superseded_count)
+        if self.video_recorder is not None:
+            self.metrics.gauge("tello_recorder_frames_encoded",
+                "Frames written to recorded video.", self.metrics_labels,
+                function=lambda: self.video_recorder.encoded_count)
+            self.metrics.gauge("tello_recorder_frames_dropped",
+                "Frames not recorded: queue overflow, same frame slot or "
+                "chunk file not opened.",
+                self.metrics_labels,
+                function=lambda: self.video_recorder.dropped_count)
+        self.metrics.gauge("tello_command_queue_depth",
+            "Commands waiting to be sent.", self.metrics_labels,
+            function=self.command_scheduler.depth)
+        for thread_name in ("comm_handle_thread", "video_receive_thread"):
+            self.metrics.gauge("tello_thread_alive",
+                "1 if the thread is running.",
+                dict(self.metrics_labels, thread=thread_name),
+                function=lambda thread_name=thread_name:
+                    self.thread_alive(thread_name))
 
         # Threads
         self._comm_handle_running = True
@@ -70,33 +196,42 @@ class Tello():
         self._comm_handle_dead = False
         self._video_receive_dead = False
         self._response_received = False
-        
+        self._last_response = None
+        self._response_condition = threading.Condition()
+        # Control commands are not sent until startup sequence is finished.
+        self._startup_complete = False
+        self._video_ingest = None
+        self._video_receive_thread = None
+
+        # Load face detector in parallel with startup sequence.
+        self._detector_load_thread = threading.Thread(
+            target=self.load_face_detector)
+        self.detector_load_thread.start()
+
+        # Start Tello state receiving thread.
+        self._state_receiver = TelloStateReceiver(self.mac_ip,
+            self.tello_state_port, self.tello_ip)
+
         # Start command handligh thread.
         self._comm_handle_thread = threading.Thread(target=self.comm_handle)
         self.comm_handle_thread.start()
 
-        # Tello sends response when command is received, not when it is
-        # completed. For this reason time.sleep() is needed to wait for actual
-        # command execution before sending next command.
-
-        self.send_command("command")
-        time.sleep(1)
-
-        self.send_command("takeoff")
-        time.sleep(7)
-
-        self.send_command("up 60")
-        time.sleep(2)
-        
-        self.send_command("streamon")
-        time.sleep(1)
-
-        self._video_cap = cv2.VideoCapture("udp://@{}:{}".format(self.mac_ip, self.video_receive_port))
-        self.video_cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)
-
-        # Start video stream receiving thread.
-        self._video_receive_thread = threading.Thread(target=self.video_receive)
-        self.video_receive_thread.start()
+        # Enter SDK mode, switch video stream on, take off and climb, waiting
+        # for acknowledgements and Tello state instead of fixed time. Video
+        # stream receiving thread is started as soon as the stream is on.
+        self._startup_sequencer = StartupSequencer(self, self.state_receiver,
+            on_stream_on=self.start_video_receive)
+        startup_success = self.startup_sequencer.run()
+        if self.video_receive_thread is None:
+            self.start_video_receive()
+        if startup_success:
+            self.startup_complete = True
+        else:
+            # Do not follow with a failed startup, land if airborne.
+            self.land()
+            # Send log.
+            msg = "Startup failed, landing. Follow-me flight is disabled."
+            self.log_message(self.err_tag, msg)
 
     #--------------------------------------------------------------------------
     # End Init
@@ -106,6 +241,10 @@ class Tello():
     # Getters
     #--------------------------------------------------------------------------
 
+    @property
+    def name(self):
+        return self._name
+
     @property
     def tello_ip(self):
         return self._tello_ip
@@ -130,14 +269,34 @@ class Tello():
     def comm_receive_port(self):
         return self._comm_receive_port
 
+    @property
+    def video_url(self):
+        return self._video_url
+
+    @property
+    def luma_only(self):
+        return self._luma_only
+
+    @property
+    def skip_late_frames(self):
+        return self._skip_late_frames
+
     @property
     def comm_sock(self):
         return self._comm_sock
 
+    @property
+    def detector_pool(self):
+        return self._detector_pool
+
     @property
     def haar_face_detector(self):
         return self._haar_face_detector
 
+    @property
+    def motion_gate(self):
+        return self._motion_gate
+
     @property
     def frame(self):
         return self._frame
@@ -146,6 +305,34 @@ class Tello():
     def face_rect(self):
         return self._face_rect
 
+    @property
+    def face_rect_time(self):
+        return self._face_rect_time
+
+    @property
+    def frame_bus_name(self):
+        return self._frame_bus_name
+
+    @property
+    def frame_bus(self):
+        return self._frame_bus
+
+    @property
+    def offload_client(self):
+        return self._offload_client
+
+    @property
+    def offload_requests(self):
+        return self._offload_requests
+
+    @property
+    def offload_fallbacks(self):
+        return self._offload_fallbacks
+
+    @property
+    def video_recorder(self):
+        return self._video_recorder
+
     @property
     def info_tag(self):
         return self._info_tag
@@ -154,6 +341,18 @@ class Tello():
     def err_tag(self):
         return self._err_tag
 
+    @property
+    def owns_logger(self):
+        return self._owns_logger
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def face_event_id(self):
+        return self._face_event_id
+
     @property
     def x_threshold(self):
         return self._x_threshold
@@ -178,13 +377,61 @@ class Tello():
     def target_face_height(self):
         return self._target_face_height
 
+    @property
+    def target_face_height_scale(self):
+        return self._target_face_height_scale
+
     @property
     def target_y_distance(self):
         return self._target_y_distance
 
     @property
-    def command_queue(self):
-        return self._command_queue
+    def command_scheduler(self):
+        return self._command_scheduler
+
+    @property
+    def command_sent_time(self):
+        return self._command_sent_time
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def metrics_labels(self):
+        return self._metrics_labels
+
+    @property
+    def frames_captured(self):
+        return self._frames_captured
+
+    @property
+    def frames_dropped(self):
+        return self._frames_dropped
+
+    @property
+    def capture_fps(self):
+        return self._capture_fps
+
+    @property
+    def detection_latency(self):
+        return self._detection_latency
+
+    @property
+    def detections(self):
+        return self._detections
+
+    @property
+    def detection_hits(self):
+        return self._detection_hits
+
+    @property
+    def detections_skipped(self):
+        return self._detections_skipped
+
+    @property
+    def command_rtt(self):
+        return self._command_rtt
 
     @property
     def comm_handle_running(self):
@@ -211,13 +458,41 @@ class Tello():
         return self._comm_handle_thread
 
     @property
-    def video_cap(self):
-        return self._video_cap
+    def video_ingest(self):
+        return self._video_ingest
 
     @property
     def video_receive_thread(self):
         return self._video_receive_thread
 
+    @property
+    def detector_loaded(self):
+        return self._detector_loaded
+
+    @property
+    def detector_load_thread(self):
+        return self._detector_load_thread
+
+    @property
+    def last_response(self):
+        return self._last_response
+
+    @property
+    def response_condition(self):
+        return self._response_condition
+
+    @property
+    def startup_complete(self):
+        return self._startup_complete
+
+    @property
+    def state_receiver(self):
+        return self._state_receiver
+
+    @property
+    def startup_sequencer(self):
+        return self._startup_sequencer
+
     #--------------------------------------------------------------------------
     # End Getters
     #--------------------------------------------------------------------------
@@ -234,6 +509,10 @@ class Tello():
     def face_rect(self, new_face_rect):
         self._face_rect = new_face_rect
 
+    @face_rect_time.setter
+    def face_rect_time(self, new_face_rect_time):
+        self._face_rect_time = new_face_rect_time
+
     @comm_handle_running.setter
     def comm_handle_running(self, new_comm_handle_running):
         self._comm_handle_running = new_comm_handle_running
@@ -254,6 +533,22 @@ class Tello():
     def response_received(self, new_response_received):
         self._response_received = new_response_received
 
+    @command_sent_time.setter
+    def command_sent_time(self, new_command_sent_time):
+        self._command_sent_time = new_command_sent_time
+
+    @haar_face_detector.setter
+    def haar_face_detector(self, new_haar_face_detector):
+        self._haar_face_detector = new_haar_face_detector
+
+    @last_response.setter
+    def last_response(self, new_last_response):
+        self._last_response = new_last_response
+
+    @startup_complete.setter
+    def startup_complete(self, new_startup_complete):
+        self._startup_complete = new_startup_complete
+
     #--------------------------------------------------------------------------
     # End Setters
     #--------------------------------------------------------------------------
@@ -265,33 +560,67 @@ class Tello():
     #--------------------------------------------------------------------------
     # Command Handling Methonds
     #--------------------------------------------------------------------------
+
+    def init_movement_control(self, merge_moves=False):
+
+        """Method for initializing control law parameters and command
+        scheduler.
+
+        IN:
+            merge_moves - bool - merge up/down and forward/back moves into
+                "go" commands."""
+
+        # X axis
+        self._x_threshold = 5 # deg
+        self._max_turn_degrees = 41 # deg
+        # Z axis
+        self._z_threshold = 20 # cm
+        self._max_z_distance = 50 # cm
+        # Y axis
+        self._y_threshold = 20 # cm
+        self._target_face_height = 65 # px
+        # Frame scale the target face height was measured at.
+        self._target_face_height_scale = 0.5
+        self._target_y_distance = 80 # cm
+
+        # Pending commands, one slot per axis.
+        self._command_scheduler = CommandScheduler(merge_moves=merge_moves)
+        self._command_sent_time = None
         
     def comm_handle(self):
 
         """Method for commands sending/responce receiving thread.
         
+        High-priority command (land/emergency) is sent right away.
         While there is no response after sending command - wait for response.
         While not waiting for response - calculate and send control command."""
 
         start_time = datetime.datetime.now()
         while self.comm_handle_running:
             try:
-                if not self.response_received:
+                if self.command_scheduler.has_priority():
+                    # Preempt waiting for response of the previous command.
+                    self.execute_command()
+                elif not self.response_received:
                     self.receive_response()
+                elif not self.startup_complete:
+                    # Startup sequence is sending commands itself.
+                    time.sleep(0.05)
                 else:
                     # Send empty "command" every 5 seconds to keep Tello in SDK mode.
                     if (datetime.datetime.now() - start_time).total_seconds() >= 5:
                         self.send_command("command")
                         start_time = datetime.datetime.now()
                     else:
-                        if self.face_rect is not None:
+                        if (self.face_rect is not None
+                                and not self.command_scheduler.stopped):
                             # Calculate and send control commands.
                             self.handle_commands()
                         else:
                             time.sleep(1)
             except Exception as e:
                 # Send log.
-                self.log_message(self.err_tag, str(e))
+                self.log_message(self.err_tag, str(e), key=self.err_tag + str(e))
         self.comm_handle_dead = True
 
     def receive_response(self):
@@ -300,10 +629,17 @@ class Tello():
 
         # Read 1024 bytes from UDP socket.
         resp_msg = self.comm_sock.recvfrom(1024)[0]
-        self.response_received = True
+        resp_msg = resp_msg.decode(encoding="utf-8").strip()
+        with self.response_condition:
+            self.last_response = resp_msg
+            self.response_received = True
+            self.response_condition.notify_all()
+        if self.command_sent_time is not None:
+            self.command_rtt.observe(time.perf_counter() - self.command_sent_time)
+            self.command_sent_time = None
 
         # Send log.
-        msg = "Command response: {}".format(resp_msg.decode(encoding="utf-8"))
+        msg = "Command response: {}".format(resp_msg)
         self.log_message(self.info_tag, msg)
 
     def send_command(self, comm):
@@ -315,22 +651,44 @@ class Tello():
         comm = comm.encode(encoding="utf-8")
         self.comm_sock.sendto(comm, (self.tello_ip, self.comm_send_port))
         self.response_received = False
+        self.command_sent_time = time.perf_counter()
 
         # Send log.
         msg = "Sending command: {}".format(comm)
         self.log_message(self.info_tag, msg)
 
+    def send_command_and_wait(self, comm, timeout):
+
+        """Method for sending command and waiting for its response.
+
+        Response is received by the command handling thread.
+
+        IN:
+            comm - str - command to be sent to Tello.
+            timeout - float - maximum waiting time in seconds.
+        OUT:
+            response - str - Tello response, None if timeout expired.
+        """
+
+        with self.response_condition:
+            self.send_command(comm)
+            if not self.response_condition.wait_for(
+                    lambda: self.response_received, timeout):
+                return
+            return self.last_response
+
     def handle_commands(self):
 
         """Method for handling commands.
         
-        Adds commands to command queue and initiates their execution."""
-
-        if self.command_queue_is_empty():
-            self.calculate_x_command()
-            self.calculate_z_command()
-            self.calculate_y_command()
-        else:
+        Recalculates commands for all axes from the latest detection, so
+        that pending commands are replaced by fresh ones, and sends the next
+        command."""
+
+        self.calculate_x_command()
+        self.calculate_z_command()
+        self.calculate_y_command()
+        if not self.command_queue_is_empty():
             self.execute_command()
 
     def calculate_x_command(self):
@@ -359,16 +717,19 @@ class Tello():
         # Send log.
         msg = "Frame center X: {}, Face center X: {}, X diff: {}"
         msg = msg.format(frame_center_x, face_center_x, x_center_diff)
-        self.log_message(self.info_tag, msg)
+        self.log_message(self.info_tag, msg, key=self.info_tag + "x_command")
 
-        # If turn_degrees axceed threshold, add a new command to the command
-        # queue.
+        # If turn_degrees axceed threshold, put a new command into X axis
+        # slot, otherwise drop pending X axis command.
         if turn_degrees > self.x_threshold:
             if x_center_diff > 0:
                 direction = "ccw"
             else:
                 direction = "cw"
-            self.command_queue.append("{} {}".format(direction, turn_degrees))
+            self.command_scheduler.submit("x", "{} {}".format(direction, turn_degrees),
+                timestamp=self.face_rect_time)
+        else:
+            self.command_scheduler.cancel("x")
 
     def calculate_z_command(self):
 
@@ -396,16 +757,19 @@ class Tello():
         # Send log.
         msg = "Frame center Z: {}, Face center Z: {}, Z diff: {}"
         msg = msg.format(frame_center_z, face_center_z, z_center_diff)
-        self.log_message(self.info_tag, msg)
+        self.log_message(self.info_tag, msg, key=self.info_tag + "z_command")
 
-        # If horizontal_distance axceed threshold, add a new command to the
-        # command queue.
+        # If horizontal_distance axceed threshold, put a new command into Z
+        # axis slot, otherwise drop pending Z axis command.
         if horizontal_distance > self.z_threshold:
             if z_center_diff > 0:
                 direction = "down"
             else:
                 direction = "up"
-            self.command_queue.append("{} {}".format(direction, horizontal_distance))
+            self.command_scheduler.submit("z", "{} {}".format(direction, horizontal_distance),
+                timestamp=self.face_rect_time)
+        else:
+            self.command_scheduler.cancel("z")
 
     def calculate_y_command(self):
 
@@ -414,8 +778,10 @@ class Tello():
         Determines forward/back movement distance and direction based on face
         recognition results."""
 
-        # Get face's bounding box height.
-        face_height = self.face_rect[3]
+        # Get face's bounding box height at the scale target_face_height was
+        # measured at.
+        face_height = self.face_rect[3] * self.target_face_height_scale
+        face_height = max(1, int(face_height / self.haar_face_detector.input_scale))
 
         # We want to keep Tello at the distance of 80 cm from the face.
         # Face's bounding box at such distance has height of approx. 65 px.
@@ -427,34 +793,51 @@ class Tello():
         # Calculate forward/back movement distance.
         vertical_distance = abs(current_distance - self.target_y_distance)
 
-        # If vertical_distance axceed threshold, add a new command to the
-        # command queue.
+        # If vertical_distance axceed threshold, put a new command into Y axis
+        # slot, otherwise drop pending Y axis command.
         if vertical_distance > self.y_threshold:
             if current_distance >= self.target_y_distance:
                 direction = "forward"
             else:
                 direction = "back"
-            self.command_queue.append("{} {}".format(direction, vertical_distance))
+            self.command_scheduler.submit("y", "{} {}".format(direction, vertical_distance),
+                timestamp=self.face_rect_time)
+        else:
+            self.command_scheduler.cancel("y")
 
         # Send log.
         msg = "Target height: {}, Face height: {}, current distance: {}"
         msg = msg.format(self.target_face_height, face_height, current_distance)
-        self.log_message(self.info_tag, msg)
+        self.log_message(self.info_tag, msg, key=self.info_tag + "y_command")
 
     def execute_command(self):
 
         """Method for executing command.
         
-        Gets the first command from the command queue and sends it to Tello."""
+        Gets the next command from the command scheduler and sends it to
+        Tello."""
 
-        comm = self.command_queue.pop(0)
-        self.send_command(comm)
+        comm = self.command_scheduler.next_command()
+        if comm is not None:
+            self.send_command(comm)
 
     def command_queue_is_empty(self):
 
-        """Method for checking if command queue is empty."""
+        """Method for checking if command scheduler has nothing to send."""
 
-        return len(self.command_queue) == 0
+        return self.command_scheduler.is_empty()
+
+    def land(self):
+
+        """Method for landing Tello ahead of all pending commands."""
+
+        self.command_scheduler.submit_priority("land")
+
+    def emergency(self):
+
+        """Method for stopping Tello motors ahead of all pending commands."""
+
+        self.command_scheduler.submit_priority("emergency")
 
     #--------------------------------------------------------------------------
     # End Command Handling Methonds
@@ -464,44 +847,293 @@ class Tello():
     # Video Handling Methonds
     #--------------------------------------------------------------------------
 
+    def load_face_detector(self):
+
+        """Method for loading face detector in the background."""
+
+        try:
+            if self.detector_pool is not None:
+                # Detection parameters are taken from the pool's detector.
+                self.haar_face_detector = self.detector_pool.detector
+                self.detector_pool.register(self.stream_id(),
+                    self.handle_detection)
+            elif self._face_detector is not None:
+                self.haar_face_detector = self._face_detector
+            else:
+                self.haar_face_detector = HaarCascadeFaceDetector(
+                    params=self._detector_params)
+            for name in ("frontal", "profile"):
+                self.metrics.gauge("tello_detector_load_seconds",
+                    "Cascade loading time, 0 until loaded.",
+                    dict(self.metrics_labels, cascade=name),
+                    function=lambda name=name:
+                        self.haar_face_detector.load_times.get(name, 0))
+
+            # Send log.
+            msg = "Face detector loaded in {:.3f} s."
+            msg = msg.format(sum(self.haar_face_detector.load_times.values()))
+            self.log_message(self.info_tag, msg)
+        except Exception as e:
+            # Send log.
+            self.log_message(self.err_tag, str(e))
+        finally:
+            self.detector_loaded.set()
+
+    def start_video_receive(self):
+
+        """Method for starting video stream receiving thread."""
+
+        self._video_receive_thread = threading.Thread(target=self.video_receive)
+        self.video_receive_thread.start()
+
+    def open_video_capture(self):
+
+        """Method for opening video stream from Tello."""
+
+        self._video_ingest = VideoIngest(self.video_url, self.luma_only,
+            self.skip_late_frames)
+        if self.luma_only and not self.video_ingest.luma_only:
+            # Send log.
+            msg = "Luma-only decoding needs PyAV and a stream URL, decoding to BGR."
+            self.log_message(self.err_tag, msg)
+        if self.video_ingest.skip_late_frames:
+            self.metrics.gauge("tello_decode_lag_seconds",
+                "Video decoding lag behind real time.", self.metrics_labels,
+                function=lambda: self.video_ingest.lag)
+            self.metrics.counter("tello_decode_catchups_total",
+                "Times video decoding started skipping frames to catch up.",
+                self.metrics_labels,
+                function=lambda: self.video_ingest.catchup_count)
+            self.metrics.counter("tello_decode_keyframe_jumps_total",
+                "Times video decoding fell back to keyframes only.",
+                self.metrics_labels,
+                function=lambda: self.video_ingest.keyframe_jump_count)
+            self.metrics.counter("tello_decode_frames_skipped_total",
+                "Frames skipped without decoding while catching up.",
+                self.metrics_labels,
+                function=lambda: self.video_ingest.skipped_frame_count)
+        self.video_ingest.open()
+
     def video_receive(self):
 
-        """Method for receiving video frames throught UDP socket from Tello."""
+        """Method for receiving video frames throught UDP socket from Tello.
 
+        Opens video stream and waits for face detector to be loaded first."""
+
+        self.open_video_capture()
+        self.detector_loaded.wait()
+
+        last_frame_time = None
         while self.video_receive_running:
             try:
-                frame_res, frame = self.video_cap.read()
-                if frame_res:
+                frame_res, frame = self.video_ingest.read()
+                if not frame_res:
+                    self.frames_dropped.inc()
+                else:
+                    self.frames_captured.inc()
+                    now = time.perf_counter()
+                    if last_frame_time is not None and now > last_frame_time:
+                        fps = 1 / (now - last_frame_time)
+                        self.capture_fps.set(0.9*self.capture_fps.value + 0.1*fps)
+                    last_frame_time = now
+
+                    # Share decoded frame with subscriber processes, luma
+                    # only in luma mode.
+                    is_lazy = isinstance(frame, LazyFrame)
+                    if self.frame_bus_name is not None:
+                        self.publish_frame(frame.luma if is_lazy else frame)
+
                     # Resize frame to improve performance.
                     height, width, _ = frame.shape
-                    frame = cv2.resize(frame, (width//2, height//2))
-                    
-                    # Detect face.
-                    detected_face = self.haar_face_detector.detect_face(frame)
-                    if detected_face is not None:
-                        self.frame, self.face_rect = detected_face
+                    scale = self.haar_face_detector.input_scale
+                    size = (int(width*scale), int(height*scale))
+                    if is_lazy:
+                        frame = frame.resize(size)
+                    else:
+                        frame = cv2.resize(frame, size)
+
+                    # Reuse previous face if the region around it did not
+                    # change.
+                    if (self.motion_gate is not None
+                            and not self.motion_gate.should_detect(
+                                frame.luma if is_lazy else frame, self.face_rect)):
+                        self.detections_skipped.inc()
+                        if self.face_rect is not None:
+                            # Face is confirmed in this frame.
+                            self.face_rect_time = time.monotonic()
+                        self.frame = self.haar_face_detector.draw_face_roi(frame,
+                            self.face_rect)
+                        self.record_frame(self.frame)
+                    # Detect face on the detection server.
+                    elif self.offload_client is not None:
+                        self.offload_detect(frame)
                     else:
-                        self.frame = frame
+                        self.detect_locally(frame)
             except Exception as e:
                 # Send log.
-                self.log_message(self.err_tag, str(e))
+                self.log_message(self.err_tag, str(e), key=self.err_tag + str(e))
         self.video_receive_dead = True
 
-    def show_video_frame(self):
+    def detect_locally(self, frame):
 
-        """Method for displaying Tello video stream using OpenCV library."""
+        """Method for detecting face, on the shared pool if there is one.
 
-        if self.frame is not None:
-            cv2.imshow("Tello Client", self.frame)
-            cv2.setWindowProperty("Tello Client", cv2.WND_PROP_TOPMOST, 1)
-            cv2.waitKey(1)
+        IN:
+            frame - numpy.ndarray - resized frame."""
+
+        self._offload_frame_index += 1
+        self._detected_frame_index = self._offload_frame_index
+        if self.detector_pool is not None:
+            self.detector_pool.submit(self.stream_id(), frame)
         else:
+            detection_start = time.perf_counter()
+            detected_face = self.haar_face_detector.detect_face(frame)
+            self.handle_detection(frame, detected_face,
+                time.perf_counter() - detection_start)
+
+    def offload_detect(self, frame):
+
+        """Method for detecting face on the detection server.
+
+        Handles replies received since the previous frame and sends the
+        frame, unless max_in_flight requests are waiting already; then the
+        previous face is reused. While replies are late or the server is not
+        reachable, faces are detected locally.
+
+        IN:
+            frame - numpy.ndarray - resized frame."""
+
+        replies, late = self.offload_client.collect()
+        if late:
+            self._offload_lagging = True
+        for _, face_rect, (frame_index, reply_frame), rtt in replies:
+            # Replies that were not late end lagging.
+            self._offload_lagging = False
+            if frame_index <= self._detected_frame_index:
+                continue
+            self._detected_frame_index = frame_index
+            detected_face = None
+            if face_rect is not None:
+                detected_face = (self.haar_face_detector.draw_face_roi(
+                    reply_frame, face_rect), face_rect)
+            self.handle_detection(reply_frame, detected_face, rtt)
+
+        image = frame.luma if isinstance(frame, LazyFrame) else frame
+        if self.offload_client.submit(image,
+                (self._offload_frame_index + 1, frame)) is not None:
+            self._offload_frame_index += 1
+            self.offload_requests.inc()
+            if not self._offload_lagging:
+                return
+        elif not self._offload_lagging and self.offload_client.connected:
+            if self.face_rect is not None:
+                frame = self.haar_face_detector.draw_face_roi(frame,
+                    self.face_rect)
+            self.frame = frame
+            self.record_frame(frame)
+            return
+
+        self.offload_fallbacks.inc()
+        self.detect_locally(frame)
+
+    def publish_frame(self, frame):
+
+        """Method for publishing decoded frame to the frame bus.
+
+        IN:
+            frame - numpy.ndarray - decoded frame."""
+
+        if self.frame_bus is None:
+            self._frame_bus = FrameBus(frame.shape, name=self.frame_bus_name)
+            # Send log.
+            msg = "Publishing frames to frame bus {}.".format(self.frame_bus.name)
+            self.log_message(self.info_tag, msg)
+        self.frame_bus.publish(frame)
+
+    def handle_detection(self, frame, detected_face, detection_time):
+
+        """Method for storing face detection results.
+
+        IN:
+            frame - numpy.ndarray - analyzed frame.
+            detected_face - tuple - (img, face_rect) as returned by
+                HaarCascadeFaceDetector.detect_face(), None if no face was
+                detected.
+            detection_time - float - detection time in seconds."""
+
+        try:
+            self.detection_latency.observe(detection_time)
+            self.detections.inc()
+            if detected_face is not None:
+                self.detection_hits.inc()
+                self.frame, self.face_rect = detected_face
+                self.face_rect_time = time.monotonic() - detection_time
+                self.logger.log_event(self.face_event_id, *self.face_rect)
+            else:
+                self.frame = frame
+                # Keep detecting until the face is found again.
+                if self.motion_gate is not None:
+                    self.motion_gate.reset()
+            self.record_frame(self.frame)
+        except Exception as e:
+            # Send log.
+            self.log_message(self.err_tag, str(e), key=self.err_tag + str(e))
+
+    def record_frame(self, frame):
+
+        """Method for passing annotated frame to the video recorder.
+
+        IN:
+            frame - numpy.ndarray - frame with drawn face bounding box."""
+
+        if self.video_recorder is not None:
+            self.video_recorder.submit(frame)
+
+    def stream_id(self):
+
+        """Method for getting video stream identifier in detector pool."""
+
+        return self.name if self.name is not None else self.tello_ip
+
+    def show_video_frame(self, wait=True):
+
+        """Method for displaying Tello video stream using OpenCV library.
+
+        IN:
+            wait - bool - sleep for 1 s if there is no frame yet. False when
+                several drones are displayed in turn, so that drones without
+                a frame do not freeze the display of the others."""
+
+        window_name = "Tello Client"
+        if self.name is not None:
+            window_name = "Tello Client {}".format(self.name)
+        frame = self.frame
+        if isinstance(frame, LazyFrame):
+            frame = frame.bgr()
+        if frame is not None:
+            cv2.imshow(window_name, frame)
+            cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
+            cv2.waitKey(1)
+        elif wait:
             time.sleep(1)
 
     #--------------------------------------------------------------------------
     # End Video Handling Methonds
     #--------------------------------------------------------------------------
 
+    def thread_alive(self, thread_name):
+
+        """Method for checking if Tello thread is running.
+
+        IN:
+            thread_name - str - "comm_handle_thread" or "video_receive_thread".
+        OUT:
+            alive - int - 1 if the thread was started and is running, else 0.
+        """
+
+        thread = getattr(self, "_" + thread_name, None)
+        return int(thread is not None and thread.is_alive())
+
     #--------------------------------------------------------------------------
     # Thread Terminators
     #--------------------------------------------------------------------------
@@ -514,9 +1146,18 @@ class Tello():
         msg = "Terminating Tello."
         self.log_message(self.info_tag, msg)
 
+        self.command_scheduler.clear()
         self.send_command("land")
         self.terminate_comm_handle()
         self.terminate_video_response()
+        self.state_receiver.terminate()
+        self.detector_load_thread.join()
+        if self.detector_pool is not None:
+            self.detector_pool.unregister(self.stream_id())
+        elif self.haar_face_detector is not None:
+            self.haar_face_detector.terminate()
+        if self.owns_logger:
+            self.logger.terminate()
 
     def terminate_comm_handle(self):
 
@@ -542,26 +1183,46 @@ class Tello():
         self.log_message(self.info_tag, msg)
 
         self.video_receive_running = False
-        self.video_cap.release()
-        cv2.destroyAllWindows()
-        # Wait for thread to stop working.
-        while not self.video_receive_dead:
-            time.sleep(1)
-        self.video_receive_thread.join()
+        try:
+            cv2.destroyAllWindows()
+        except cv2.error:
+            # Headless OpenCV build, no window was shown.
+            pass
+        if self.video_receive_thread is not None:
+            # Wait for thread to stop working.
+            while not self.video_receive_dead:
+                time.sleep(1)
+            self.video_receive_thread.join()
+            self.video_ingest.release()
+        if self.frame_bus is not None:
+            self.frame_bus.terminate()
+        if self.offload_client is not None:
+            self.offload_client.terminate()
+        if self.video_recorder is not None:
+            self.video_recorder.terminate()
+            # Send log.
+            msg = "Recorded {} frames in {} files, {} frames dropped."
+            msg = msg.format(self.video_recorder.encoded_count,
+                self.video_recorder.chunk_count,
+                self.video_recorder.dropped_count)
+            self.log_message(self.info_tag, msg)
 
     #--------------------------------------------------------------------------
     # End Thread Terminators
     #--------------------------------------------------------------------------
 
-    def log_message(self, tag, msg):
+    def log_message(self, tag, msg, key=None):
         
         """Method for logging messages.
+
+        Puts message into the logger queue, never blocks on I/O.
         
         IN:
             tag - str - message tag (TELLO_INFO or TELLO_ERR)
-            msg - str - message to be logged."""
+            msg - str - message to be logged.
+            key - str - rate limiting key, not rate limited if None."""
 
-        print(tag + msg)
+        self.logger.log(tag, msg, key)
 
     #--------------------------------------------------------------------------
     # End Class Methods
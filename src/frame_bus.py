@@ -0,0 +1,358 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# Shared memory layout:
+#   header - int64[8]: magic, num_of_slots, height, width, channels,
+#       last published sequence number, 2 reserved;
+#   slot sequence numbers - int64[num_of_slots]: 2*seq-1 while frame seq is
+#       being written to the slot, 2*seq when it is complete;
+#   slots - uint8[num_of_slots, height, width, channels], 64-byte aligned.
+_MAGIC = 0x54454c4c4f425553 # "TELLOBUS"
+_HEADER_SIZE = 8
+_LAST_SEQ = 5
+
+
+def _slots_offset(num_of_slots):
+
+    """Returns byte offset of the first slot."""
+
+    offset = 8 * (_HEADER_SIZE + num_of_slots)
+    return -(-offset // 64) * 64
+
+
+class FrameBus():
+
+    """Class for publishing decoded frames to other processes.
+
+    Frames are written into a fixed ring of slots in shared memory. The
+    producer never waits for subscribers: a subscriber that falls more than
+    the ring size behind skips ahead to frames still in the ring.
+
+    A segment of the same name left by a publisher that did not terminate
+    (e.g. crashed) is removed and created again.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, frame_shape, name=None, num_of_slots=8):
+        self._frame_shape = tuple(frame_shape) + (1,) * (3 - len(frame_shape))
+        self._num_of_slots = num_of_slots
+        frame_size = int(np.prod(self.frame_shape))
+        size = _slots_offset(num_of_slots) + num_of_slots*frame_size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                size=size)
+        except FileExistsError:
+            stale_shm = shared_memory.SharedMemory(name=name)
+            stale_shm.close()
+            stale_shm.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                size=size)
+
+        self._header, self._slot_seqs, self._slots = _map_bus(self.shm.buf,
+            num_of_slots, self.frame_shape)
+        self._slot_seqs[:] = 0
+        self._header[:] = (_MAGIC, num_of_slots) + self.frame_shape + (0, 0, 0)
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def frame_shape(self):
+        return self._frame_shape
+
+    @property
+    def num_of_slots(self):
+        return self._num_of_slots
+
+    @property
+    def shm(self):
+        return self._shm
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def last_seq(self):
+        return int(self._header[_LAST_SEQ])
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def publish(self, frame):
+
+        """Writes frame into the next slot. Never blocks.
+
+        IN:
+            frame - numpy.ndarray - frame of frame_shape.
+        OUT:
+            seq - int - sequence number of the published frame.
+        """
+
+        seq = self.last_seq + 1
+        slot = seq % self.num_of_slots
+        self._slot_seqs[slot] = 2*seq - 1
+        self._slots[slot].reshape(frame.shape)[...] = frame
+        self._slot_seqs[slot] = 2*seq
+        self._header[_LAST_SEQ] = seq
+
+        return seq
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for closing and removing shared memory."""
+
+        self._header = self._slot_seqs = self._slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+class FrameBusSubscriber():
+
+    """Class for reading frames published to a FrameBus.
+
+    Every subscriber keeps its own cursor, so subscribers read independently
+    of each other. Frames are returned as views into shared memory, without
+    copying: a view stays valid until the producer laps the ring, which
+    is_valid() checks.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, name, start_at_latest=True):
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 tracks attached memory and would remove it when
+            # the subscriber process exits. A tracker that is already running
+            # was inherited from (or is) the producer's one and already
+            # tracks the memory, so only a fresh registration is undone.
+            tracker_running = getattr(resource_tracker._resource_tracker,
+                "_fd", None) is not None
+            self._shm = shared_memory.SharedMemory(name=name)
+            if not tracker_running:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        header = np.ndarray((_HEADER_SIZE,), np.int64, self.shm.buf)
+        if header[0] != _MAGIC:
+            raise ValueError("{} is not a frame bus".format(name))
+        self._num_of_slots = int(header[1])
+        self._frame_shape = tuple(int(value) for value in header[2:5])
+        self._header, self._slot_seqs, self._slots = _map_bus(self.shm.buf,
+            self.num_of_slots, self.frame_shape)
+
+        # Sequence number of the last frame read.
+        self._cursor = self.last_seq if start_at_latest else 0
+        self._skipped_count = 0
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def shm(self):
+        return self._shm
+
+    @property
+    def num_of_slots(self):
+        return self._num_of_slots
+
+    @property
+    def frame_shape(self):
+        return self._frame_shape
+
+    @property
+    def last_seq(self):
+        return int(self._header[_LAST_SEQ])
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    @property
+    def skipped_count(self):
+        return self._skipped_count
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def read_next(self, timeout=None):
+
+        """Reads the next unread frame.
+
+        If the producer lapped the subscriber, skips ahead to the oldest
+        frame still in the ring.
+
+        IN:
+            timeout - float - maximum waiting time for a new frame in seconds,
+                wait forever if None.
+        OUT:
+            (seq, frame) - tuple - sequence number and view of the frame,
+                None if timeout expired.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            last_seq = self.last_seq
+            if last_seq > self.cursor:
+                # Keep 1 slot of margin, it may be being overwritten.
+                oldest_seq = max(1, last_seq - self.num_of_slots + 2)
+                seq = max(self.cursor + 1, oldest_seq)
+                self._skipped_count += seq - self.cursor - 1
+                slot = seq % self.num_of_slots
+                if self._slot_seqs[slot] == 2*seq:
+                    self._cursor = seq
+                    frame = self._slots[slot]
+                    if self.frame_shape[2] == 1:
+                        frame = frame[..., 0]
+                    return seq, frame
+                # Overwritten while reading, skip ahead.
+                self._skipped_count += 1
+                self._cursor = seq
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.001)
+
+    def read_latest(self, timeout=None):
+
+        """Reads the newest frame, skipping all older unread ones.
+
+        IN:
+            timeout - float - maximum waiting time for a new frame in seconds,
+                wait forever if None.
+        OUT:
+            (seq, frame) - tuple - as in read_next(), None if timeout expired.
+        """
+
+        last_seq = self.last_seq
+        if last_seq - 1 > self.cursor:
+            self._skipped_count += last_seq - 1 - self.cursor
+            self._cursor = last_seq - 1
+        return self.read_next(timeout)
+
+    def is_valid(self, seq):
+
+        """Checks if a frame view is still intact after it was used.
+
+        IN:
+            seq - int - sequence number returned with the frame.
+        OUT:
+            valid - bool - False if the slot was overwritten meanwhile.
+        """
+
+        return self._slot_seqs[seq % self.num_of_slots] == 2*seq
+
+    def read_copy(self, timeout=None):
+
+        """Reads the next unread frame into a private copy.
+
+        OUT:
+            (seq, frame) - tuple - as in read_next(), None if timeout
+                expired.
+        """
+
+        while True:
+            result = self.read_next(timeout)
+            if result is None:
+                return
+            seq, frame = result
+            frame = frame.copy()
+            if self.is_valid(seq):
+                return seq, frame
+            self._skipped_count += 1
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for detaching from shared memory."""
+
+        self._header = self._slot_seqs = self._slots = None
+        self.shm.close()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+def _map_bus(buf, num_of_slots, frame_shape):
+
+    """Maps header, slot sequence numbers and slots onto shared memory.
+
+    OUT:
+        (header, slot_seqs, slots) - tuple - numpy.ndarray views.
+    """
+
+    header = np.ndarray((_HEADER_SIZE,), np.int64, buf)
+    slot_seqs = np.ndarray((num_of_slots,), np.int64, buf, 8*_HEADER_SIZE)
+    slots = np.ndarray((num_of_slots,) + tuple(frame_shape), np.uint8, buf,
+        _slots_offset(num_of_slots))
+
+    return header, slot_seqs, slots
+
+
+if __name__ == "__main__":
+    # Preview subscriber, for testing purposes.
+
+    import argparse
+
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Preview frames of a frame bus.")
+    parser.add_argument("name", help="frame bus shared memory name")
+    args = parser.parse_args()
+
+    frame_bus_subscriber = FrameBusSubscriber(args.name)
+    while True:
+        result = frame_bus_subscriber.read_latest(timeout=1)
+        if result is not None:
+            cv2.imshow("Frame Bus Preview", result[1])
+        cv2.waitKey(1)
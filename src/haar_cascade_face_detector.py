@@ -1,27 +1,80 @@
 """Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
 
+import concurrent.futures
 import cv2
+import json
+import os
+import threading
+import time
+
+from video_ingest import LazyFrame
+
+
+# Data directory, resolved independently of the working directory.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "data")
 
 
 class HaarCascadeFaceDetector():
 
     """Class for detecting faces in images.
     
-    Uses Haar Cascade classifier from OpenCV library."""
+    Uses Haar Cascade classifier from OpenCV library.
+
+    Profile cascade is loaded on its first use. Loading times are kept in
+    load_times.
+
+    In tiled mode, the image is split into overlapping tiles detected in a
+    thread pool, and the results are merged with non-maximum suppression.
+    This allows detection at full resolution within the same latency on
+    multi-core machines. Tiles overlap by the largest face they detect, so
+    every such face is whole in some tile; larger faces are detected on the
+    whole image at half resolution, in parallel with the tiles. Tiles are
+    cut from full resolution frames, so input_scale is 1 in tiled mode.
+    """
 
     #--------------------------------------------------------------------------
     # Init
     #--------------------------------------------------------------------------
 
-    def __init__(self):
+    def __init__(self,
+            params_config=os.path.join(DATA_DIR, "haar_cascade_params.json"),
+            params=None):
         # Colors.
         self._blue = (255, 0, 0)
         self._red = (0, 0, 255)
         # Load configuration files.
-        self._frontal_config = "../data/haarcascade_frontalface_alt2.xml"
-        self._profile_config = "../data/haarcascade_profileface.xml"
-        self._frontal_face_detector = cv2.CascadeClassifier(self.frontal_config)
-        self._profile_face_detector = cv2.CascadeClassifier(self.profile_config)
+        self._frontal_config = os.path.join(DATA_DIR, "haarcascade_frontalface_alt2.xml")
+        self._profile_config = os.path.join(DATA_DIR, "haarcascade_profileface.xml")
+        # Cascade name: loading time in seconds.
+        self._load_times = {}
+        self._frontal_face_detector = self.load_cascade("frontal",
+            self.frontal_config)
+        # Profile cascade is only needed when no frontal face is found.
+        self._profile_face_detector = None
+        self._profile_load_lock = threading.Lock()
+
+        # Detection parameters. Defaults are overridden by the parameters
+        # file written by cascade_tuner.py, and then by params argument.
+        self._params_config = params_config
+        self._scale_factor = 1.3
+        self._min_neighbors = 5
+        self._min_size = (0, 0) # px
+        # Scale of video frames passed to the detector.
+        self._input_scale = 0.5
+        # Tiled detection.
+        self._tiled = False
+        self._tile_grid = (2, 2) # columns, rows
+        # Largest face detected on tiles, in full resolution (960x720) px.
+        # Tiles overlap by this size at the input scale.
+        self._tile_max_face_size = 200 # px
+        # Intersection over union above which overlapping faces are merged.
+        self._nms_threshold = 0.3
+        self.load_params(params_config, params)
+
+        # Tile detection threads, each with its own cascades.
+        self._tile_executor = None
+        self._tile_cascades = threading.local()
 
     #--------------------------------------------------------------------------
     # End Init
@@ -47,14 +100,68 @@ class HaarCascadeFaceDetector():
     def profile_config(self):
         return self._profile_config
 
+    @property
+    def load_times(self):
+        return self._load_times
+
     @property
     def frontal_face_detector(self):
         return self._frontal_face_detector
 
     @property
     def profile_face_detector(self):
+        # Load profile cascade on first use.
+        if self._profile_face_detector is None:
+            with self._profile_load_lock:
+                if self._profile_face_detector is None:
+                    self._profile_face_detector = self.load_cascade("profile",
+                        self.profile_config)
         return self._profile_face_detector
 
+    @property
+    def params_config(self):
+        return self._params_config
+
+    @property
+    def scale_factor(self):
+        return self._scale_factor
+
+    @property
+    def min_neighbors(self):
+        return self._min_neighbors
+
+    @property
+    def min_size(self):
+        return self._min_size
+
+    @property
+    def input_scale(self):
+        return self._input_scale
+
+    @property
+    def tiled(self):
+        return self._tiled
+
+    @property
+    def tile_grid(self):
+        return self._tile_grid
+
+    @property
+    def tile_max_face_size(self):
+        return self._tile_max_face_size
+
+    @property
+    def nms_threshold(self):
+        return self._nms_threshold
+
+    @property
+    def tile_executor(self):
+        return self._tile_executor
+
+    @property
+    def tile_cascades(self):
+        return self._tile_cascades
+
     #--------------------------------------------------------------------------
     # End Getters
     #--------------------------------------------------------------------------
@@ -63,6 +170,34 @@ class HaarCascadeFaceDetector():
     # Setters
     #--------------------------------------------------------------------------
 
+    @scale_factor.setter
+    def scale_factor(self, new_scale_factor):
+        self._scale_factor = new_scale_factor
+
+    @min_neighbors.setter
+    def min_neighbors(self, new_min_neighbors):
+        self._min_neighbors = new_min_neighbors
+
+    @min_size.setter
+    def min_size(self, new_min_size):
+        self._min_size = new_min_size
+
+    @input_scale.setter
+    def input_scale(self, new_input_scale):
+        self._input_scale = new_input_scale
+
+    @tiled.setter
+    def tiled(self, new_tiled):
+        self._tiled = new_tiled
+
+    @tile_grid.setter
+    def tile_grid(self, new_tile_grid):
+        self._tile_grid = new_tile_grid
+
+    @tile_max_face_size.setter
+    def tile_max_face_size(self, new_tile_max_face_size):
+        self._tile_max_face_size = new_tile_max_face_size
+
     #--------------------------------------------------------------------------
     # End Setters
     #--------------------------------------------------------------------------
@@ -71,27 +206,252 @@ class HaarCascadeFaceDetector():
     # Class Methods
     #--------------------------------------------------------------------------
 
+    def load_cascade(self, name, config):
+
+        """Loads cascade classifier.
+
+        IN:
+            name - str - cascade name used in load_times.
+            config - str - path to the cascade XML file.
+        OUT:
+            cascade - cv2.CascadeClassifier - loaded classifier.
+        """
+
+        start_time = time.perf_counter()
+        cascade = cv2.CascadeClassifier(config)
+        if cascade.empty():
+            raise IOError("Could not load cascade {}".format(config))
+        self.load_times[name] = time.perf_counter() - start_time
+
+        return cascade
+
+    def load_params(self, params_config, params=None):
+
+        """Loads detection parameters.
+
+        IN:
+            params_config - str - path to JSON file with detection parameters
+                (scale_factor, min_neighbors, min_size, input_scale, tiled,
+                tile_grid, tile_max_face_size). Ignored if the file does not
+                exist.
+            params - dict - parameters overriding the ones from the file.
+        """
+
+        loaded_params = {}
+        if params_config is not None and os.path.isfile(params_config):
+            with open(params_config) as params_file:
+                loaded_params.update(json.load(params_file))
+        if params is not None:
+            loaded_params.update(params)
+
+        self.scale_factor = loaded_params.get("scale_factor", self.scale_factor)
+        self.min_neighbors = loaded_params.get("min_neighbors", self.min_neighbors)
+        self.min_size = tuple(loaded_params.get("min_size", self.min_size))
+        self.input_scale = loaded_params.get("input_scale", self.input_scale)
+        self.tiled = loaded_params.get("tiled", self.tiled)
+        self.tile_grid = tuple(loaded_params.get("tile_grid", self.tile_grid))
+        self.tile_max_face_size = loaded_params.get("tile_max_face_size",
+            self.tile_max_face_size)
+        if self.tiled:
+            self.input_scale = 1.0
+
+    def find_faces(self, img_gray, cascades=None, min_size=None,
+            max_size=(0, 0)):
+
+        """Runs frontal and then profile cascade on a grayscale image.
+
+        IN:
+            img_gray - numpy.ndarray - grayscale image to be analyzed.
+            cascades - tuple - (frontal, profile) callables returning
+                cascade classifiers, detector's own cascades if None.
+            min_size - tuple - smallest face size, detector's min_size if
+                None.
+            max_size - tuple - largest face size, not limited if (0, 0).
+        OUT:
+            faces - numpy.ndarray or tuple - [top_left_x, top_left_y, width,
+                height] of every detected face, empty if nothing was found.
+        """
+
+        if cascades is None:
+            cascades = (lambda: self.frontal_face_detector,
+                lambda: self.profile_face_detector)
+        if min_size is None:
+            min_size = self.min_size
+
+        # Detect frontal face.
+        faces = cascades[0]().detectMultiScale(img_gray, self.scale_factor,
+            self.min_neighbors, minSize=min_size, maxSize=max_size)
+        # If no frontal face was detected, try detecting profile face.
+        if len(faces) == 0:
+            faces = cascades[1]().detectMultiScale(img_gray, self.scale_factor,
+                self.min_neighbors, minSize=min_size, maxSize=max_size)
+
+        return faces
+
+    def find_faces_tiled(self, img_gray):
+
+        """Runs detection on overlapping tiles of the image in parallel.
+
+        Faces larger than the tile overlap are detected on the whole image
+        at half resolution, in parallel with the tiles.
+
+        IN:
+            img_gray - numpy.ndarray - grayscale image to be analyzed.
+        OUT:
+            faces - list - [top_left_x, top_left_y, width, height] of every
+                detected face after non-maximum suppression.
+        """
+
+        if self.tile_executor is None:
+            num_of_jobs = self.tile_grid[0] * self.tile_grid[1] + 1
+            self._tile_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(num_of_jobs, os.cpu_count() or 1))
+
+        max_face_size = self.tile_face_size()
+        jobs = [(x_start, y_start, 1, img_gray[y_start:y_end, x_start:x_end],
+                None, (max_face_size, max_face_size))
+            for x_start, y_start, x_end, y_end in self.tile_rects(
+                img_gray.shape)]
+        # Larger faces, on the whole image at half resolution.
+        img_half = cv2.resize(img_gray, None, fx=0.5, fy=0.5,
+            interpolation=cv2.INTER_AREA)
+        min_half_size = max(self.min_size[0] // 2, max_face_size // 2 + 1)
+        jobs.append((0, 0, 2, img_half, (min_half_size, min_half_size),
+            (0, 0)))
+
+        faces = []
+        for x_start, y_start, scale, job_faces in self.tile_executor.map(
+                lambda job: (job[0], job[1], job[2], self.find_faces(job[3],
+                    self.thread_cascades(), job[4], job[5])), jobs):
+            faces.extend([int(x)*scale + x_start, int(y)*scale + y_start,
+                int(width)*scale, int(height)*scale]
+                for x, y, width, height in job_faces)
+
+        return self.suppress_overlaps(faces)
+
+    def tile_face_size(self):
+
+        """Returns largest face size detected on tiles, at the input scale."""
+
+        return max(1, int(self.tile_max_face_size * self.input_scale))
+
+    def tile_rects(self, img_shape):
+
+        """Splits image into tiles overlapping by tile_face_size().
+
+        A face up to the overlap size lies whole in some tile: if it starts
+        left of a tile's overlap margin, it ends before the previous tile's
+        one.
+
+        IN:
+            img_shape - tuple - (height, width) of the image.
+        OUT:
+            tile_rects - list - (x_start, y_start, x_end, y_end) of every
+                tile.
+        """
+
+        img_height, img_width = img_shape[:2]
+        columns, rows = self.tile_grid
+        tile_width = -(-img_width // columns)
+        tile_height = -(-img_height // rows)
+        half_overlap = -(-self.tile_face_size() // 2)
+
+        tile_rects = []
+        for row in range(rows):
+            for column in range(columns):
+                tile_rects.append((max(0, column*tile_width - half_overlap),
+                    max(0, row*tile_height - half_overlap),
+                    min(img_width, (column+1)*tile_width + half_overlap),
+                    min(img_height, (row+1)*tile_height + half_overlap)))
+
+        return tile_rects
+
+    def thread_cascades(self):
+
+        """Returns cascades of the current tile detection thread.
+
+        Cascade classifiers are not shared between threads, so every tile
+        thread loads its own on first use.
+
+        OUT:
+            cascades - tuple - (frontal, profile) callables returning cascade
+                classifiers.
+        """
+
+        local = self.tile_cascades
+        if not hasattr(local, "frontal"):
+            local.frontal = self.load_cascade("tile_frontal",
+                self.frontal_config)
+            local.profile = None
+
+        def profile():
+            if local.profile is None:
+                local.profile = self.load_cascade("tile_profile",
+                    self.profile_config)
+            return local.profile
+
+        return (lambda: local.frontal, profile)
+
+    def suppress_overlaps(self, faces):
+
+        """Merges detections of the same face from overlapping tiles.
+
+        Greedy non-maximum suppression: larger boxes are kept, boxes
+        overlapping a kept one by more than nms_threshold (intersection over
+        union), or lying mostly inside it (a face cut by a tile border), are
+        dropped.
+
+        IN:
+            faces - list - [top_left_x, top_left_y, width, height] boxes.
+        OUT:
+            kept_faces - list - boxes left after suppression.
+        """
+
+        kept_faces = []
+        for face in sorted(faces, key=lambda face: face[2]*face[3],
+                reverse=True):
+            x, y, width, height = face
+            suppressed = False
+            for kept_x, kept_y, kept_width, kept_height in kept_faces:
+                inter_width = min(x+width, kept_x+kept_width) - max(x, kept_x)
+                inter_height = min(y+height, kept_y+kept_height) - max(y, kept_y)
+                if inter_width <= 0 or inter_height <= 0:
+                    continue
+                inter = inter_width * inter_height
+                union = width*height + kept_width*kept_height - inter
+                if (inter / union > self.nms_threshold
+                        or inter / (width*height) > 0.7):
+                    suppressed = True
+                    break
+            if not suppressed:
+                kept_faces.append(face)
+
+        return kept_faces
+
     def detect_face(self, img):
 
         """Detects face in a given image using OpenCV Haarcascade Classifier.
         
         IN:
-            img - numpy.ndarray - image to be analyzed.
+            img - numpy.ndarray or LazyFrame - image to be analyzed.
         OUT:
             (img, faces[0]) - tuple - if face was detected.
-                img - numpy.ndarray - image with detected face.
+                img - numpy.ndarray or LazyFrame - image with detected face.
                 faces[0] - numpy.ndarray - [top_left_x, top_left_y, width,
                     height] of the detected image bounding box.
             None - if no face was detected.
         """
 
-        # Convert image into grayscale.
-        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # Detect frontal face.
-        faces = self.frontal_face_detector.detectMultiScale(img_gray, 1.3, 5)
-        # If no frontal face was detected, try detecting profile face.
-        if len(faces) == 0:
-            faces = self.profile_face_detector.detectMultiScale(img_gray, 1.3, 5)
+        # Convert image into grayscale, lazy frames carry luma already.
+        if isinstance(img, LazyFrame):
+            img_gray = img.luma
+        else:
+            img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Detect frontal or profile face, on tiles in tiled mode.
+        if self.tiled:
+            faces = self.find_faces_tiled(img_gray)
+        else:
+            faces = self.find_faces(img_gray)
         
         # If no faces were detected, return None.
         if len(faces) == 0:
@@ -111,13 +471,18 @@ class HaarCascadeFaceDetector():
         centrral point of the image frame - red. 
         
         IN:
-            img - numpy.ndarray - image to be analyzed.
+            img - numpy.ndarray or LazyFrame - image to be analyzed.
             face - numpy.ndarray - [top_left_x, top_left_y, width,
                 height] of the detected image bounding box.
         OUT:
             img - numpy.ndarray - image with ROI.
         """
 
+        # Lazy frames are drawn on when converted to BGR.
+        if isinstance(img, LazyFrame):
+            img.annotate(self.draw_face_roi, face)
+            return img
+
         x, y, width, height = face
         # Draw rectangle on the image.
         img = cv2.rectangle(img, (x, y), (x+width, y+height), self.blue, 2)
@@ -132,6 +497,21 @@ class HaarCascadeFaceDetector():
 
         return img
 
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for stopping tile detection threads."""
+
+        if self.tile_executor is not None:
+            self.tile_executor.shutdown()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
     #--------------------------------------------------------------------------
     # End Class Methods
     #--------------------------------------------------------------------------
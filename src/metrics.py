@@ -0,0 +1,360 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Counter():
+
+    """Monotonically increasing metric.
+
+    If function is given, the value is read by calling it at scrape time,
+    for counts kept by other objects."""
+
+    def __init__(self, function=None):
+        self._value = 0
+        self._function = function
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def inc(self, amount=1):
+
+        """Increases counter by the given amount."""
+
+        with self._lock:
+            self._value += amount
+
+    def samples(self, name, labels):
+
+        """Returns (name, labels, value) samples of the metric."""
+
+        return [(name, labels, self.value)]
+
+
+class Gauge():
+
+    """Metric that can go up and down.
+
+    If function is given, the value is calculated by calling it at scrape
+    time, so nothing has to be updated in the hot path."""
+
+    def __init__(self, function=None):
+        self._value = 0
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def set(self, value):
+
+        """Sets gauge value."""
+
+        self._value = value
+
+    def samples(self, name, labels):
+
+        """Returns (name, labels, value) samples of the metric."""
+
+        return [(name, labels, self.value)]
+
+
+class Histogram():
+
+    """Metric counting observations in cumulative buckets."""
+
+    def __init__(self, buckets):
+        self._buckets = tuple(sorted(buckets))
+        # Last counter is the +Inf bucket.
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def observe(self, value):
+
+        """Adds observation to the histogram."""
+
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self, name, labels):
+
+        """Returns (name, labels, value) samples of the metric."""
+
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            bucket_labels = labels + (("le", _format_value(bound)),)
+            samples.append((name + "_bucket", bucket_labels, cumulative))
+        samples.append((name + "_sum", labels, total))
+        samples.append((name + "_count", labels, cumulative))
+
+        return samples
+
+
+class MetricsRegistry():
+
+    """Class for keeping metrics and rendering them in Prometheus text format.
+
+    Metrics with the same name and different labels are rendered as one
+    metric family."""
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self):
+        # name: (type, help, {labels: metric}).
+        self._families = {}
+        self._lock = threading.Lock()
+        # Default histogram buckets for latencies, in seconds.
+        self._latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+            0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def families(self):
+        return self._families
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def latency_buckets(self):
+        return self._latency_buckets
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def counter(self, name, help_text, labels=None, function=None):
+
+        """Returns counter with the given name and labels, creates it if
+        needed.
+
+        IN:
+            function - callable - returns counter value at scrape time."""
+
+        return self.get_metric("counter", name, help_text, labels,
+            lambda: Counter(function))
+
+    def gauge(self, name, help_text, labels=None, function=None):
+
+        """Returns gauge with the given name and labels, creates it if
+        needed.
+
+        IN:
+            function - callable - calculates gauge value at scrape time."""
+
+        return self.get_metric("gauge", name, help_text, labels,
+            lambda: Gauge(function))
+
+    def histogram(self, name, help_text, labels=None, buckets=None):
+
+        """Returns histogram with the given name and labels, creates it if
+        needed.
+
+        IN:
+            buckets - tuple - bucket upper bounds, latency_buckets if None."""
+
+        if buckets is None:
+            buckets = self.latency_buckets
+        return self.get_metric("histogram", name, help_text, labels,
+            lambda: Histogram(buckets))
+
+    def get_metric(self, metric_type, name, help_text, labels, factory):
+
+        """Returns registered metric or registers a new one.
+
+        IN:
+            metric_type - str - "counter", "gauge" or "histogram".
+            name - str - metric name.
+            help_text - str - metric description.
+            labels - dict - metric labels.
+            factory - callable - creates a new metric.
+        """
+
+        labels = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            family = self.families.setdefault(name,
+                (metric_type, help_text, {}))
+            if family[0] != metric_type:
+                raise ValueError("Metric {} is already registered as {}".format(
+                    name, family[0]))
+            if labels not in family[2]:
+                family[2][labels] = factory()
+            return family[2][labels]
+
+    def render(self):
+
+        """Renders all metrics in Prometheus text exposition format.
+
+        OUT:
+            text - str - metrics page."""
+
+        with self.lock:
+            families = [(name, family[0], family[1], list(family[2].items()))
+                for name, family in sorted(self.families.items())]
+
+        lines = []
+        for name, metric_type, help_text, metrics in families:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, metric in metrics:
+                try:
+                    samples = metric.samples(name, labels)
+                except Exception:
+                    # Gauge function failed, e.g. object is being terminated.
+                    continue
+                for sample_name, sample_labels, value in samples:
+                    lines.append("{}{} {}".format(sample_name,
+                        _format_labels(sample_labels), _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+class MetricsServer():
+
+    """Class for exposing metrics over local HTTP endpoint.
+
+    Serves MetricsRegistry.render() output at /metrics from a background
+    thread."""
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self._registry = registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode(encoding="utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type",
+                    "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                # Do not write request logs to the terminal.
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server_thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def registry(self):
+        return self._registry
+
+    @property
+    def server(self):
+        return self._server
+
+    @property
+    def server_thread(self):
+        return self._server_thread
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for stopping HTTP server thread."""
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+
+def _format_labels(labels):
+
+    """Formats labels tuple as {name="value",...}."""
+
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name,
+        str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels) + "}"
+
+
+def _format_value(value):
+
+    """Formats sample value, including infinity."""
+
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        value = int(value)
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,167 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import time
+
+import cv2
+
+
+class MotionGate():
+
+    """Class for skipping face detection on unchanged frames.
+
+    Compares a downsampled grayscale copy of the frame with the one taken at
+    the last full detection. Only the region around the last detected face
+    is compared, split into blocks: if the mean absolute difference of every
+    block stays under the threshold, the previous face bounding box is still
+    valid and cascades are not run. Full detection is forced at least every
+    max_interval seconds.
+
+    The reference is only changed by the thread calling should_detect;
+    reset() may be called from any thread and takes effect on its next call.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, max_interval=0.5, threshold=6):
+        # Downsampled frame size.
+        self._small_width = 80 # px
+        self._small_height = 60 # px
+        # Face region is extended by this fraction of the face size on every
+        # side.
+        self._margin = 0.5
+        # Number of compared blocks on every side of the region.
+        self._num_of_blocks = 4
+        # Maximum mean absolute difference of a block, in intensity levels.
+        self._threshold = threshold
+        # Maximum time between full detections.
+        self._max_interval = max_interval # s
+
+        self._reference = None
+        self._reference_time = None
+        self._reset_requested = False
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def small_width(self):
+        return self._small_width
+
+    @property
+    def small_height(self):
+        return self._small_height
+
+    @property
+    def margin(self):
+        return self._margin
+
+    @property
+    def num_of_blocks(self):
+        return self._num_of_blocks
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def max_interval(self):
+        return self._max_interval
+
+    @property
+    def reference(self):
+        return self._reference
+
+    @property
+    def reference_time(self):
+        return self._reference_time
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def should_detect(self, frame, face_rect):
+
+        """Checks if full face detection has to be run on the frame.
+
+        The frame becomes the new reference when detection is needed.
+
+        IN:
+            frame - numpy.ndarray - BGR or grayscale frame.
+            face_rect - numpy.ndarray - [top_left_x, top_left_y, width,
+                height] of the last detected face, None if there is none.
+        OUT:
+            detect - bool - False if the previous face_rect can be reused.
+        """
+
+        small = cv2.resize(frame, (self.small_width, self.small_height),
+            interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        now = time.monotonic()
+        if self._reset_requested:
+            self._reset_requested = False
+            self._reference = None
+
+        if (face_rect is None or self.reference is None
+                or now - self.reference_time >= self.max_interval
+                or self.region_changed(small, frame.shape, face_rect)):
+            self._reference = small
+            self._reference_time = now
+            return True
+
+        return False
+
+    def region_changed(self, small, frame_shape, face_rect):
+
+        """Checks if the region around the face changed since the reference.
+
+        IN:
+            small - numpy.ndarray - downsampled grayscale frame.
+            frame_shape - tuple - full frame shape.
+            face_rect - numpy.ndarray - [top_left_x, top_left_y, width,
+                height] of the last detected face.
+        OUT:
+            changed - bool - True if any block's mean absolute difference
+                exceeds the threshold.
+        """
+
+        scale_x = self.small_width / frame_shape[1]
+        scale_y = self.small_height / frame_shape[0]
+        x, y, width, height = face_rect
+        x_start = max(0, int((x - self.margin*width) * scale_x))
+        y_start = max(0, int((y - self.margin*height) * scale_y))
+        x_end = min(self.small_width, int((x + (1+self.margin)*width) * scale_x) + 1)
+        y_end = min(self.small_height, int((y + (1+self.margin)*height) * scale_y) + 1)
+        if x_end <= x_start or y_end <= y_start:
+            return True
+
+        diff = cv2.absdiff(small[y_start:y_end, x_start:x_end],
+            self.reference[y_start:y_end, x_start:x_end])
+        # Area interpolation averages the difference over every block.
+        num_of_blocks_x = min(self.num_of_blocks, x_end - x_start)
+        num_of_blocks_y = min(self.num_of_blocks, y_end - y_start)
+        blocks = cv2.resize(diff, (num_of_blocks_x, num_of_blocks_y),
+            interpolation=cv2.INTER_AREA)
+
+        return blocks.max() > self.threshold
+
+    def reset(self):
+
+        """Forces full detection on the next frame. Thread safe."""
+
+        self._reset_requested = True
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
@@ -0,0 +1,656 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from haar_cascade_face_detector import HaarCascadeFaceDetector
+
+
+# Messages over TCP:
+#   request - sequence number, JPEG size, grayscale JPEG frame;
+#   reply - sequence number, face found flag, face_rect (x, y, width,
+#       height) in the sent frame's pixels.
+_REQUEST_HEADER = struct.Struct("<QI")
+_REPLY = struct.Struct("<QB4i")
+
+
+class OffloadDetectionClient():
+
+    """Class for running face detection on a remote DetectionServer.
+
+    Responsible for:
+        - sending grayscale JPEG frames tagged with sequence numbers;
+        - connecting and sending on its own thread, from a one frame buffer
+          holding the latest frame, so a stalled network or server never
+          blocks the caller;
+        - keeping at most max_in_flight requests waiting for replies;
+        - expiring requests whose replies are later than reply_timeout, so
+          that the caller falls back to local detection;
+        - dropping requests the server replaced with a newer one, without
+          counting them late;
+        - reconnecting after the connection is lost.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, server_address, max_in_flight=2, reply_timeout=0.15,
+            jpeg_quality=80):
+        if isinstance(server_address, str):
+            host, port = server_address.rsplit(":", 1)
+            server_address = (host, int(port))
+        self._server_address = server_address
+        self._max_in_flight = max_in_flight
+        self._reply_timeout = reply_timeout # s
+        self._jpeg_quality = jpeg_quality
+        self._reconnect_interval = 2 # s
+
+        self._sock = None
+        self._seq = 0
+        # seq: (submit time, context).
+        self._in_flight = {}
+        # (seq, grayscale frame) waiting for the sending thread, replaced by
+        # newer frames.
+        self._pending = None
+        # (seq, face_rect, context, round trip time) of received replies.
+        self._replies = []
+        self._late_count = 0
+        self._superseded_count = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+
+        # Threads
+        self._running = True
+        self._receive_thread = None
+        self._send_thread = threading.Thread(target=self.send, daemon=True)
+        self.send_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def server_address(self):
+        return self._server_address
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    @property
+    def reply_timeout(self):
+        return self._reply_timeout
+
+    @property
+    def jpeg_quality(self):
+        return self._jpeg_quality
+
+    @property
+    def reconnect_interval(self):
+        return self._reconnect_interval
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    @property
+    def late_count(self):
+        return self._late_count
+
+    @property
+    def superseded_count(self):
+        return self._superseded_count
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def receive_thread(self):
+        return self._receive_thread
+
+    @property
+    def send_thread(self):
+        return self._send_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def connect(self):
+
+        """Connects to the server, on the sending thread.
+
+        OUT:
+            connected - bool - True if connected.
+        """
+
+        try:
+            sock = socket.create_connection(self.server_address,
+                timeout=self.reply_timeout)
+        except OSError:
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        with self._lock:
+            if not self.running:
+                sock.close()
+                return False
+            self._sock = sock
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+        self._receive_thread = threading.Thread(target=self.receive,
+            args=(sock,), daemon=True)
+        self.receive_thread.start()
+
+        return True
+
+    def disconnect(self, sock):
+
+        """Closes the connection and forgets its requests."""
+
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+                self._in_flight.clear()
+                self._pending = None
+        try:
+            # Unblocks the other thread using the connection.
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def submit(self, frame, context=None):
+
+        """Queues frame for sending. Never waits for the network.
+
+        A frame still waiting for the sending thread is replaced and counted
+        as superseded.
+
+        IN:
+            frame - numpy.ndarray - BGR or grayscale frame. A grayscale
+                frame must not be modified afterwards.
+            context - any - returned with the reply (e.g. the frame).
+        OUT:
+            seq - int - request sequence number, None if not queued because
+                too many requests are in flight or the server is not
+                connected.
+        """
+
+        if not self.connected:
+            return
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        with self._condition:
+            if self._sock is None or len(self._in_flight) >= self.max_in_flight:
+                return
+            if self._pending is not None:
+                # Unless expired already.
+                self._in_flight.pop(self._pending[0], None)
+                self._superseded_count += 1
+            self._seq += 1
+            seq = self._seq
+            self._in_flight[seq] = (time.perf_counter(), context)
+            self._pending = (seq, frame)
+            self._condition.notify()
+
+        return seq
+
+    def send(self):
+
+        """Method for request sending thread.
+
+        Connects to the server, at most once per reconnect_interval, and
+        sends queued frames."""
+
+        while True:
+            with self._condition:
+                while (self.running and self._sock is not None
+                        and self._pending is None):
+                    self._condition.wait()
+                if not self.running:
+                    break
+                sock = self._sock
+                request, self._pending = self._pending, None
+
+            if sock is None:
+                if not self.connect():
+                    with self._condition:
+                        self._condition.wait(self.reconnect_interval)
+                continue
+
+            seq, frame = request
+            jpeg = cv2.imencode(".jpg", frame,
+                (cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality))[1]
+            try:
+                sock.sendall(_REQUEST_HEADER.pack(seq, len(jpeg))
+                    + jpeg.tobytes())
+            except OSError:
+                self.disconnect(sock)
+
+    def receive(self, sock):
+
+        """Method for reply receiving thread of one connection."""
+
+        try:
+            while True:
+                seq, found, *face_rect = _REPLY.unpack(_recv_exactly(sock,
+                    _REPLY.size))
+                with self._lock:
+                    request = self._in_flight.pop(seq, None)
+                    # The server only detects the latest request of a
+                    # connection, older ones are never replied to.
+                    superseded_seqs = [in_flight_seq for in_flight_seq
+                        in self._in_flight if in_flight_seq < seq]
+                    for in_flight_seq in superseded_seqs:
+                        del self._in_flight[in_flight_seq]
+                    self._superseded_count += len(superseded_seqs)
+                    # Expired requests are ignored.
+                    if request is not None:
+                        self._replies.append((seq,
+                            np.array(face_rect) if found else None,
+                            request[1], time.perf_counter() - request[0]))
+        except (OSError, ConnectionError):
+            self.disconnect(sock)
+
+    def collect(self):
+
+        """Returns received replies and expires late requests.
+
+        OUT:
+            (replies, late) - tuple:
+                replies - list - (seq, face_rect, context, round trip time)
+                    in order of arrival, face_rect None if no face was found.
+                late - bool - True if a request expired waiting for its reply.
+        """
+
+        deadline = time.perf_counter() - self.reply_timeout
+        with self._lock:
+            replies, self._replies = self._replies, []
+            late_seqs = [seq for seq, (send_time, _) in self._in_flight.items()
+                if send_time < deadline]
+            for seq in late_seqs:
+                del self._in_flight[seq]
+            self._late_count += len(late_seqs)
+
+        return replies, bool(late_seqs)
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for closing the connection and stopping client threads."""
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+            sock = self._sock
+        if sock is not None:
+            # Unblocks sending and receiving threads.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.send_thread.join()
+        if sock is not None:
+            self.disconnect(sock)
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+class DetectionServer():
+
+    """Class for serving face detection to OffloadDetectionClients.
+
+    Every client connection has a receiving thread, which keeps only the
+    client's latest request: an older one not yet taken for detection is
+    replaced, its client has moved on. Replaced requests get no reply, the
+    client drops them when a newer one is replied to. A batching thread
+    takes the latest requests of all clients at once, waiting up to
+    batch_window for more clients to send, and detects faces in the batch in
+    parallel on worker threads with their own cascades. Replies are sent by
+    a writing thread of every client, so a slow client only delays its own
+    replies; a reply not sent yet is replaced by a newer one.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, host="0.0.0.0", port=9200, num_of_workers=None,
+            max_batch=8, batch_window=0.002):
+        self._detector = HaarCascadeFaceDetector()
+        self._executor = ThreadPoolExecutor(max_workers=num_of_workers)
+        self._max_batch = max_batch
+        self._batch_window = batch_window # s
+
+        # Latest request of every client: connection: (seq, jpeg).
+        self._pending = {}
+        # Latest reply not sent yet of every client: connection: reply.
+        self._replies = {}
+        self._condition = threading.Condition()
+        self._batch_count = 0
+        self._frame_count = 0
+
+        self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind((host, port))
+        self.server_sock.listen()
+        self.server_sock.settimeout(0.5)
+        self._connections = set()
+
+        # Threads
+        self._running = True
+        self._client_threads = []
+        self._accept_thread = threading.Thread(target=self.accept,
+            daemon=True)
+        self._batch_thread = threading.Thread(target=self.detect_batches,
+            daemon=True)
+        self.accept_thread.start()
+        self.batch_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def detector(self):
+        return self._detector
+
+    @property
+    def executor(self):
+        return self._executor
+
+    @property
+    def max_batch(self):
+        return self._max_batch
+
+    @property
+    def batch_window(self):
+        return self._batch_window
+
+    @property
+    def condition(self):
+        return self._condition
+
+    @property
+    def batch_count(self):
+        return self._batch_count
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def server_sock(self):
+        return self._server_sock
+
+    @property
+    def port(self):
+        return self.server_sock.getsockname()[1]
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def accept_thread(self):
+        return self._accept_thread
+
+    @property
+    def batch_thread(self):
+        return self._batch_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @running.setter
+    def running(self, new_running):
+        self._running = new_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def accept(self):
+
+        """Method for connection accepting thread."""
+
+        while self.running:
+            try:
+                conn, _ = self.server_sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                # Socket closed on termination.
+                break
+            conn.settimeout(None)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.condition:
+                self._connections.add(conn)
+            self._client_threads = [client_thread for client_thread
+                in self._client_threads if client_thread.is_alive()]
+            client_thread = threading.Thread(target=self.receive,
+                args=(conn,), daemon=True)
+            self._client_threads.append(client_thread)
+            client_thread.start()
+
+    def receive(self, conn):
+
+        """Method for request receiving thread of one client.
+
+        Starts the client's reply writing thread and closes the connection
+        after both are done."""
+
+        write_thread = threading.Thread(target=self.write, args=(conn,),
+            daemon=True)
+        write_thread.start()
+        try:
+            while self.running:
+                seq, size = _REQUEST_HEADER.unpack(_recv_exactly(conn,
+                    _REQUEST_HEADER.size))
+                jpeg = _recv_exactly(conn, size)
+                with self.condition:
+                    self._pending[conn] = (seq, jpeg)
+                    self.condition.notify_all()
+        except (OSError, ConnectionError):
+            pass
+        with self.condition:
+            self._pending.pop(conn, None)
+            self._replies.pop(conn, None)
+            self._connections.discard(conn)
+            self.condition.notify_all()
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        write_thread.join()
+        conn.close()
+
+    def write(self, conn):
+
+        """Method for reply writing thread of one client."""
+
+        while True:
+            with self.condition:
+                while (self.running and conn in self._connections
+                        and conn not in self._replies):
+                    self.condition.wait()
+                if not self.running or conn not in self._connections:
+                    break
+                reply = self._replies.pop(conn)
+            try:
+                conn.sendall(reply)
+            except OSError:
+                # Ends receiving thread too.
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                break
+
+    def detect_batches(self):
+
+        """Method for batching thread."""
+
+        while self.running:
+            with self.condition:
+                while self.running and not self._pending:
+                    self.condition.wait()
+                if not self.running:
+                    break
+            # Give other clients a moment to join the batch.
+            time.sleep(self.batch_window)
+            with self.condition:
+                batch = list(self._pending.items())[:self.max_batch]
+                for conn, _ in batch:
+                    del self._pending[conn]
+
+            replies = list(self.executor.map(self.detect, batch))
+            with self.condition:
+                for (conn, _), reply in zip(batch, replies):
+                    if conn in self._connections:
+                        self._replies[conn] = reply
+                self.condition.notify_all()
+            self._batch_count += 1
+            self._frame_count += len(batch)
+
+    def detect(self, request):
+
+        """Detects face in one request, on a worker thread.
+
+        IN:
+            request - tuple - (connection, (seq, jpeg)).
+        OUT:
+            reply - bytes - packed reply.
+        """
+
+        _, (seq, jpeg) = request
+        img_gray = cv2.imdecode(np.frombuffer(jpeg, np.uint8),
+            cv2.IMREAD_GRAYSCALE)
+        faces = []
+        if img_gray is not None:
+            faces = self.detector.find_faces(img_gray,
+                self.detector.thread_cascades())
+        if len(faces) == 0:
+            return _REPLY.pack(seq, 0, 0, 0, 0, 0)
+        return _REPLY.pack(seq, 1, *(int(value) for value in faces[0]))
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for closing all connections and stopping server threads."""
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.accept_thread.join()
+        self.server_sock.close()
+        with self.condition:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.batch_thread.join()
+        for client_thread in self._client_threads:
+            client_thread.join()
+        self.executor.shutdown()
+        self.detector.terminate()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+def _recv_exactly(sock, size):
+
+    """Receives exactly size bytes from a TCP socket.
+
+    Raises ConnectionError if the connection is closed."""
+
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Connection closed.")
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Serve face detection to thin Tello clients.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--workers", type=int, default=None,
+        help="detection threads (default: based on number of cores)")
+    parser.add_argument("--max-batch", type=int, default=8,
+        help="maximum frames detected at once")
+    args = parser.parse_args()
+
+    detection_server = DetectionServer(args.host, args.port, args.workers,
+        args.max_batch)
+    print("Serving face detection on {}:{}, Ctrl+C to stop.".format(args.host,
+        detection_server.port))
+    try:
+        while True:
+            time.sleep(10)
+            print("Detected {} frames in {} batches.".format(
+                detection_server.frame_count, detection_server.batch_count))
+    except KeyboardInterrupt:
+        detection_server.terminate()
@@ -0,0 +1,279 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import collections
+import dis
+import os
+import sys
+import threading
+import time
+
+
+class SamplingProfiler():
+
+    """Class for statistical profiling of all threads of a running program.
+
+    A background thread samples the stacks of all other threads every
+    interval seconds. Nothing is instrumented, but the sampling thread takes
+    the GIL for every sample, which slows Python threads down a little while
+    profiling. While the profiler is stopped, there is no overhead at all.
+
+    Samples are kept as collapsed stacks ("thread;outer;...;inner count"),
+    the input format of flame graph tools (flamegraph.pl, speedscope). C
+    functions have no frames, so the function called by the innermost frame
+    is added as "name (call)", found from the frame's current call
+    instruction (the last attribute or global loaded before it).
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, interval=0.005):
+        self._interval = interval # s
+        # Collapsed stack: number of samples.
+        self._stacks = collections.Counter()
+        self._num_of_samples = 0
+        self._start_time = None
+        self._stop_time = None
+        # (code, instruction offset): name of the called function, None if
+        # the instruction is not a call.
+        self._callees = {}
+        # Calls in which a thread waits instead of working. Samples in them
+        # are not counted towards stage times. Reads are left out, as
+        # VideoCapture.read decodes video.
+        self._blocking_calls = frozenset(("sleep", "wait", "acquire", "join",
+            "recv", "recvfrom", "recv_into", "accept", "select"))
+
+        # Threads
+        self._sample_running = False
+        self._sample_thread = None
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def stacks(self):
+        return self._stacks
+
+    @property
+    def num_of_samples(self):
+        return self._num_of_samples
+
+    @property
+    def duration(self):
+        if self._start_time is None:
+            return 0
+        stop_time = self._stop_time
+        if stop_time is None:
+            stop_time = time.monotonic()
+        return stop_time - self._start_time
+
+    @property
+    def blocking_calls(self):
+        return self._blocking_calls
+
+    @property
+    def sample_running(self):
+        return self._sample_running
+
+    @property
+    def sample_thread(self):
+        return self._sample_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @sample_running.setter
+    def sample_running(self, new_sample_running):
+        self._sample_running = new_sample_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def start(self):
+
+        """Clears previous samples and starts sampling thread."""
+
+        self.stacks.clear()
+        self._num_of_samples = 0
+        self._start_time = time.monotonic()
+        self._stop_time = None
+        self.sample_running = True
+        self._sample_thread = threading.Thread(target=self.sample,
+            daemon=True)
+        self.sample_thread.start()
+
+    def stop(self):
+
+        """Stops sampling thread. Samples are kept."""
+
+        self.sample_running = False
+        if self.sample_thread is not None:
+            self.sample_thread.join()
+            self._sample_thread = None
+        self._stop_time = time.monotonic()
+
+    def sample(self):
+
+        """Method for sampling thread."""
+
+        own_id = threading.get_ident()
+        next_sample_time = time.monotonic()
+        while self.sample_running:
+            thread_names = {thread.ident: thread.name
+                for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.stacks[self.collapse(thread_names.get(thread_id,
+                    str(thread_id)), frame)] += 1
+            self._num_of_samples += 1
+
+            next_sample_time += self.interval
+            delay = next_sample_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Sampling took longer than the interval, do not catch up.
+                next_sample_time = time.monotonic()
+
+    def collapse(self, thread_name, frame):
+
+        """Returns collapsed stack of a frame.
+
+        IN:
+            thread_name - str - name of the sampled thread.
+            frame - frame - innermost frame of the thread.
+        OUT:
+            stack - str - "thread;outer function;...;inner function".
+        """
+
+        functions = []
+        callee = self.callee(frame)
+        if callee is not None:
+            functions.append("{} (call)".format(callee))
+        while frame is not None:
+            code = frame.f_code
+            functions.append("{} ({}:{})".format(code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        functions.append(thread_name.replace(";", ":"))
+
+        return ";".join(reversed(functions))
+
+    def callee(self, frame):
+
+        """Returns name of the function a frame is calling.
+
+        IN:
+            frame - frame - innermost frame of a thread.
+        OUT:
+            callee - str - called function name, None if the frame is not
+                at a call instruction.
+        """
+
+        key = (frame.f_code, frame.f_lasti)
+        if key not in self._callees:
+            callee = None
+            current = None
+            for instruction in dis.get_instructions(frame.f_code):
+                if instruction.offset > frame.f_lasti:
+                    break
+                current = instruction
+                if instruction.opname in ("LOAD_ATTR", "LOAD_METHOD",
+                        "LOAD_GLOBAL"):
+                    callee = instruction.argval
+            if current is None or not current.opname.startswith(
+                    ("CALL", "PRECALL")):
+                callee = None
+            self._callees[key] = callee
+
+        return self._callees[key]
+
+    def stage_times(self, stages):
+
+        """Estimates time spent working in every stage from the samples.
+
+        A sample counts towards the innermost stage on the sampled stack, so
+        the time of a stage excludes stages it calls. Samples in a blocking
+        call (sleep, socket receive, lock or condition wait) are idle time
+        and are not counted.
+
+        IN:
+            stages - list - function names.
+        OUT:
+            stage_times - dict - function name: (time in seconds, number of
+                threads the stage was sampled in).
+        """
+
+        times = {stage: 0 for stage in stages}
+        threads = {stage: set() for stage in stages}
+        for stack, count in self.stacks.items():
+            thread_name, *functions = stack.split(";")
+            names = [function.split(" ", 1)[0] for function in functions]
+            if not names or names[-1] in self.blocking_calls:
+                continue
+            for name in reversed(names):
+                if name in times:
+                    times[name] += count
+                    threads[name].add(thread_name)
+                    break
+
+        # Sampling may run slower than the interval under load.
+        sample_time = self.duration / max(self.num_of_samples, 1)
+
+        return {stage: (times[stage] * sample_time, len(threads[stage]))
+            for stage in stages}
+
+    def summary(self, stages):
+
+        """Returns per-stage timing summary as text.
+
+        IN:
+            stages - list - function names.
+        """
+
+        lines = ["{} samples in {:.1f} s.".format(self.num_of_samples,
+            self.duration)]
+        duration = max(self.duration, self.interval)
+        for stage, (stage_time, num_of_threads) in self.stage_times(
+                stages).items():
+            share = stage_time / (duration * max(num_of_threads, 1))
+            lines.append("{}: {:.2f} s working in {} threads, {:.0f}% of their "
+                "time".format(stage, stage_time, num_of_threads, 100*share))
+
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+
+        """Writes collapsed stacks for flame graph tools.
+
+        IN:
+            path - str - output file path."""
+
+        with open(path, "w") as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write("{} {}\n".format(stack, count))
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
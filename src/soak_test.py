@@ -0,0 +1,491 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from haar_cascade_face_detector import HaarCascadeFaceDetector
+from tello_controller import TelloFollowMeController
+from tello_simulator import TelloSimulator
+
+
+class SoakTest():
+
+    """Class for running the follow-me stack for hours against a simulated
+    drone and checking it for leaks and drift.
+
+    Responsible for:
+        - running TelloFollowMeController against TelloSimulator and a
+          looped video file, without console and video window;
+        - sampling RSS, thread count, open sockets, capture FPS, command
+          RTT and commands received by the drone every sample_interval
+          seconds;
+        - flagging growth or drift between the start (after warmup) and
+          the end of the run beyond the thresholds;
+        - checking that terminate() leaves no threads or sockets behind.
+
+    With blob_face, the bright blob of the synthetic clip is detected as the
+    face (BlobFaceDetector), so that the control law, command scheduler and
+    movement commands run all the time, as in follow-me flight.
+
+    RSS and open sockets are read from /proc, so they are only measured on
+    Linux.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, duration, video_url, sample_interval=10, warmup=60,
+            max_rss_growth=20, max_thread_growth=0, max_socket_growth=0,
+            max_fps_drop=0.2, max_rtt_increase=0.5, blob_face=False):
+        self._duration = duration # s
+        self._video_url = video_url
+        self._sample_interval = sample_interval # s
+        # Samples taken during warmup are not analyzed.
+        self._warmup = warmup # s
+
+        # Thresholds
+        self._max_rss_growth = max_rss_growth # MB/h
+        self._max_thread_growth = max_thread_growth
+        self._max_socket_growth = max_socket_growth
+        # Relative change between the first and the last window.
+        self._max_fps_drop = max_fps_drop
+        self._max_rtt_increase = max_rtt_increase
+        # Fraction of analyzed samples averaged in the first/last window.
+        self._window = 0.1
+        # Maximum time threads get to exit after terminate().
+        self._terminate_timeout = 5 # s
+
+        # Synthetic clip's blob is detected as the face.
+        self._blob_face = blob_face
+
+        self._samples = []
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def video_url(self):
+        return self._video_url
+
+    @property
+    def sample_interval(self):
+        return self._sample_interval
+
+    @property
+    def warmup(self):
+        return self._warmup
+
+    @property
+    def max_rss_growth(self):
+        return self._max_rss_growth
+
+    @property
+    def max_thread_growth(self):
+        return self._max_thread_growth
+
+    @property
+    def max_socket_growth(self):
+        return self._max_socket_growth
+
+    @property
+    def max_fps_drop(self):
+        return self._max_fps_drop
+
+    @property
+    def max_rtt_increase(self):
+        return self._max_rtt_increase
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def terminate_timeout(self):
+        return self._terminate_timeout
+
+    @property
+    def blob_face(self):
+        return self._blob_face
+
+    @property
+    def samples(self):
+        return self._samples
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def run(self):
+
+        """Runs soak test.
+
+        OUT:
+            flags - list - descriptions of detected leaks and drift, empty if
+                the run is stable.
+        """
+
+        simulator = TelloSimulator()
+        # Threads and sockets of the simulator and the test itself are not
+        # counted as left behind.
+        baseline_threads = set(threading.enumerate())
+        baseline_sockets = count_sockets()
+
+        drone = {"tello_ip": "127.0.0.1", "mac_ip": "127.0.0.1",
+            "video_url": self.video_url}
+        if self.blob_face:
+            drone["face_detector"] = BlobFaceDetector()
+        controller = TelloFollowMeController(drones=[drone],
+            metrics_port=None, console=False)
+        try:
+            self.sample_run(controller, simulator)
+        finally:
+            controller.running = False
+            controller.terminate()
+            flags = self.check_terminate(baseline_threads, baseline_sockets)
+            simulator.terminate()
+
+        return self.analyze() + flags
+
+    def sample_run(self, controller, simulator):
+
+        """Samples process resources and pipeline rates until the end of
+        the run.
+
+        IN:
+            controller - TelloFollowMeController - running controller.
+            simulator - TelloSimulator - simulated drone."""
+
+        start_time = time.monotonic()
+        last_time = start_time
+        last_frames = self.frames_captured(controller)
+        last_faces = self.faces_detected(controller)
+        last_commands = simulator.commands_received
+        last_rtt_count, last_rtt_sum = self.command_rtt(controller)
+
+        while last_time - start_time < self.duration:
+            time.sleep(self.sample_interval)
+            now = time.monotonic()
+            frames = self.frames_captured(controller)
+            faces = self.faces_detected(controller)
+            commands = simulator.commands_received
+            rtt_count, rtt_sum = self.command_rtt(controller)
+
+            rtt = None
+            if rtt_count > last_rtt_count:
+                rtt = round(1000 * (rtt_sum-last_rtt_sum)
+                    / (rtt_count-last_rtt_count), 2)
+            self.samples.append({"time": round(now - start_time, 1),
+                "rss_mb": read_rss(), "threads": threading.active_count(),
+                "sockets": count_sockets(),
+                "fps": round((frames-last_frames) / (now-last_time), 1),
+                "faces": faces - last_faces, "commands": commands - last_commands,
+                "rtt_ms": rtt})
+            print("t: {time:.0f} s, rss: {rss_mb} MB, threads: {threads}, "
+                "sockets: {sockets}, fps: {fps}, faces: {faces}, commands: "
+                "{commands}, rtt: {rtt_ms} ms".format(**self.samples[-1]),
+                flush=True)
+
+            last_time = now
+            last_frames = frames
+            last_faces = faces
+            last_commands = commands
+            last_rtt_count, last_rtt_sum = rtt_count, rtt_sum
+
+    def frames_captured(self, controller):
+
+        """Returns number of frames captured by all drones."""
+
+        return sum(tello.frames_captured.value for tello in controller.tellos)
+
+    def faces_detected(self, controller):
+
+        """Returns number of frames with a detected face of all drones."""
+
+        return sum(tello.detection_hits.value for tello in controller.tellos)
+
+    def command_rtt(self, controller):
+
+        """Returns (count, sum) of command RTT observations of all drones."""
+
+        return (sum(tello.command_rtt.count for tello in controller.tellos),
+            sum(tello.command_rtt.sum for tello in controller.tellos))
+
+    def analyze(self):
+
+        """Compares samples at the start and the end of the run.
+
+        OUT:
+            flags - list - descriptions of detected leaks and drift.
+        """
+
+        samples = [sample for sample in self.samples
+            if sample["time"] >= self.warmup]
+        if len(samples) < 2:
+            return ["Too few samples after warmup to analyze."]
+
+        flags = []
+
+        if self.blob_face and not any(sample["faces"] for sample in samples):
+            flags.append("No face detected, control path was not exercised.")
+
+        rss = [(sample["time"], sample["rss_mb"]) for sample in samples
+            if sample["rss_mb"] is not None]
+        if len(rss) >= 2:
+            rss_growth = 3600 * slope(rss)
+            if rss_growth > self.max_rss_growth:
+                flags.append("RSS grows {:.1f} MB/h (max {} MB/h).".format(
+                    rss_growth, self.max_rss_growth))
+
+        for key, name, max_growth in (
+                ("threads", "Thread count", self.max_thread_growth),
+                ("sockets", "Open socket count", self.max_socket_growth)):
+            first, last = self.window_means(samples, key)
+            if first is not None and last - first > max_growth:
+                flags.append("{} grows from {:.1f} to {:.1f}.".format(name,
+                    first, last))
+
+        first, last = self.window_means(samples, "fps")
+        if first and (first - last) / first > self.max_fps_drop:
+            flags.append("FPS drops from {:.1f} to {:.1f}.".format(first, last))
+
+        first, last = self.window_means(samples, "rtt_ms")
+        if first and (last - first) / first > self.max_rtt_increase:
+            flags.append("Command RTT increases from {:.1f} to {:.1f} ms.".format(
+                first, last))
+
+        return flags
+
+    def window_means(self, samples, key):
+
+        """Returns means of a sampled value in the first and the last window.
+
+        OUT:
+            (first, last) - tuple - means, (None, None) if the value was not
+                measured.
+        """
+
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        if not values:
+            return None, None
+        size = max(1, int(self.window * len(values)))
+
+        return (sum(values[:size]) / size, sum(values[-size:]) / size)
+
+    def check_terminate(self, baseline_threads, baseline_sockets):
+
+        """Checks that no threads or sockets are left after terminate().
+
+        IN:
+            baseline_threads - set - threads running before the controller
+                was started.
+            baseline_sockets - int - open sockets before the controller was
+                started, None if not measured.
+        OUT:
+            flags - list - descriptions of left threads and sockets.
+        """
+
+        deadline = time.monotonic() + self.terminate_timeout
+        while True:
+            left_threads = [thread.name for thread in threading.enumerate()
+                if thread not in baseline_threads]
+            if not left_threads or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+
+        flags = []
+        if left_threads:
+            flags.append("Threads left after terminate(): {}.".format(
+                ", ".join(left_threads)))
+        sockets = count_sockets()
+        if baseline_sockets is not None and sockets > baseline_sockets:
+            flags.append("Sockets left after terminate(): {}.".format(
+                sockets - baseline_sockets))
+
+        return flags
+
+    def write_samples(self, path):
+
+        """Writes samples to a CSV file.
+
+        IN:
+            path - str - output file path."""
+
+        with open(path, "w", newline="") as samples_file:
+            writer = csv.DictWriter(samples_file, fieldnames=("time",
+                "rss_mb", "threads", "sockets", "fps", "faces", "commands",
+                "rtt_ms"))
+            writer.writeheader()
+            writer.writerows(self.samples)
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+def read_rss():
+
+    """Returns resident set size of the process in MB, None if unknown."""
+
+    try:
+        with open("/proc/self/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+
+def count_sockets():
+
+    """Returns number of open sockets of the process, None if unknown."""
+
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return
+    count = 0
+    for fd in fds:
+        try:
+            if os.readlink(os.path.join("/proc/self/fd", fd)).startswith("socket:"):
+                count += 1
+        except OSError:
+            # Closed meanwhile.
+            pass
+    return count
+
+
+def slope(points):
+
+    """Returns least squares slope of (x, y) points."""
+
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x)**2 for x, _ in points)
+    if variance == 0:
+        return 0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+class BlobFaceDetector(HaarCascadeFaceDetector):
+
+    """Face detector finding the bright blob of the synthetic clip.
+
+    Cascades are loaded as usual, so loading and metrics are unchanged, but
+    the blob's bounding box is returned as the face. It moves across, up and
+    down and changes size, so all control axes get commands.
+    """
+
+    def find_faces(self, img_gray, cascades=None, min_size=None,
+            max_size=(0, 0)):
+
+        """Returns bounding box of the bright blob, empty if there is none."""
+
+        _, mask = cv2.threshold(img_gray, 128, 255, cv2.THRESH_BINARY)
+        x, y, width, height = cv2.boundingRect(mask)
+        if width < 10 or height < 10:
+            return ()
+
+        return np.array([[x, y, width, height]])
+
+
+def write_synthetic_video(path, num_of_frames=300, fps=30, size=(960, 720)):
+
+    """Writes a video file with a bright blob moving and changing size over
+    noise.
+
+    Used as video source when no recorded clip is given. There is no real
+    face in it: full face detection runs on every frame, unless the blob is
+    detected as the face by BlobFaceDetector.
+
+    IN:
+        path - str - output file path.
+        num_of_frames - int - number of frames.
+        fps - int - frame rate.
+        size - tuple - (width, height) of frames.
+    """
+
+    width, height = size
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps,
+        size)
+    rng = np.random.default_rng(0)
+    for i in range(num_of_frames):
+        frame = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+        phase = 2*np.pi*i/num_of_frames
+        center = (int(width/2 + width/4*np.sin(phase)),
+            int(height/2 + height/6*np.sin(2*phase)))
+        scale = 1 + 0.4*np.sin(3*phase)
+        cv2.ellipse(frame, center, (int(60*scale), int(80*scale)), 0, 0, 360,
+            (200, 200, 200), -1)
+        video_writer.write(frame)
+    video_writer.release()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Soak test follow-me stack against a simulated drone.")
+    parser.add_argument("--hours", type=float, default=4,
+        help="test duration")
+    parser.add_argument("--video",
+        help="video file used as drone video stream, looped (default: "
+            "synthetic clip)")
+    parser.add_argument("--sample-interval", type=float, default=10,
+        help="seconds between samples")
+    parser.add_argument("--warmup", type=float, default=60,
+        help="seconds at the start of the run not analyzed")
+    parser.add_argument("--max-rss-growth", type=float, default=20,
+        help="MB/h")
+    parser.add_argument("--max-thread-growth", type=float, default=0)
+    parser.add_argument("--max-socket-growth", type=float, default=0)
+    parser.add_argument("--max-fps-drop", type=float, default=0.2,
+        help="relative")
+    parser.add_argument("--max-rtt-increase", type=float, default=0.5,
+        help="relative")
+    parser.add_argument("--real-detector", action="store_true",
+        help="detect faces with Haar cascades on the synthetic clip too, "
+            "instead of following its blob")
+    parser.add_argument("--output", help="CSV file for samples")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        video_url = args.video
+        # The synthetic clip's blob is followed as the face.
+        blob_face = False
+        if video_url is None:
+            video_url = os.path.join(temp_dir, "soak.mp4")
+            write_synthetic_video(video_url)
+            blob_face = not args.real_detector
+
+        soak_test = SoakTest(3600 * args.hours, video_url,
+            args.sample_interval, args.warmup, args.max_rss_growth,
+            args.max_thread_growth, args.max_socket_growth, args.max_fps_drop,
+            args.max_rtt_increase, blob_face)
+        flags = soak_test.run()
+
+    if args.output is not None:
+        soak_test.write_samples(args.output)
+    for flag in flags:
+        print("SOAK FLAG: " + flag)
+    print("Soak test {}.".format("failed" if flags else "passed"))
+    sys.exit(1 if flags else 0)
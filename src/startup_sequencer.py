@@ -0,0 +1,305 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import time
+
+
+class StartupSequencer():
+
+    """Class for bringing Tello from power-on to follow-me flight.
+
+    Instead of fixed waiting times, every step waits for the "ok"
+    acknowledgement of its command and, where needed, for a Tello state
+    condition (height reached, speed settled). Every wait has a timeout.
+
+    Video stream is switched on before takeoff, so that video pipeline warms
+    up while Tello is taking off.
+
+    Commands without acknowledgement are resent only if that cannot repeat a
+    movement: setup commands always, takeoff and climb only if fresh Tello
+    state shows they were not started. The sequence stops at the first
+    failed step.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, tello, state_receiver, on_stream_on=None):
+        self._tello = tello
+        self._state_receiver = state_receiver
+        self._on_stream_on = on_stream_on
+
+        # Timeouts
+        self._ack_timeout = 3 # s
+        self._ack_retries = 2
+        self._takeoff_ack_timeout = 10 # s
+        self._state_timeout = 8 # s
+        # Older state does not tell if a movement was started.
+        self._max_state_age = 1 # s
+
+        # Ports Tello sends state and video to, unless changed by "port"
+        # command (Tello EDU).
+        self._default_state_port = 8890
+        self._default_video_port = 11111
+
+        # State conditions
+        self._climb_distance = 60 # cm
+        self._min_hover_height = 30 # cm
+        self._height_tolerance = 15 # cm
+        self._max_settled_speed = 1 # dm/s
+        self._takeoff_height = None
+
+        # Logging
+        self._info_tag = "TELLO_STARTUP_INFO: "
+        self._err_tag = "TELLO_STARTUP_ERR: "
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def tello(self):
+        return self._tello
+
+    @property
+    def state_receiver(self):
+        return self._state_receiver
+
+    @property
+    def on_stream_on(self):
+        return self._on_stream_on
+
+    @property
+    def ack_timeout(self):
+        return self._ack_timeout
+
+    @property
+    def ack_retries(self):
+        return self._ack_retries
+
+    @property
+    def takeoff_ack_timeout(self):
+        return self._takeoff_ack_timeout
+
+    @property
+    def state_timeout(self):
+        return self._state_timeout
+
+    @property
+    def max_state_age(self):
+        return self._max_state_age
+
+    @property
+    def default_state_port(self):
+        return self._default_state_port
+
+    @property
+    def default_video_port(self):
+        return self._default_video_port
+
+    @property
+    def climb_distance(self):
+        return self._climb_distance
+
+    @property
+    def min_hover_height(self):
+        return self._min_hover_height
+
+    @property
+    def height_tolerance(self):
+        return self._height_tolerance
+
+    @property
+    def max_settled_speed(self):
+        return self._max_settled_speed
+
+    @property
+    def takeoff_height(self):
+        return self._takeoff_height
+
+    @property
+    def info_tag(self):
+        return self._info_tag
+
+    @property
+    def err_tag(self):
+        return self._err_tag
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @takeoff_height.setter
+    def takeoff_height(self, new_takeoff_height):
+        self._takeoff_height = new_takeoff_height
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def run(self):
+
+        """Runs startup sequence, stopping at the first failed step.
+
+        OUT:
+            success - bool - False if any step did not complete in time.
+        """
+
+        start_time = time.monotonic()
+
+        success = self.run_step("command", self.ack_timeout)
+        # Several drones in one process need their own state and video ports.
+        if success and (self.tello.tello_state_port != self.default_state_port
+                or self.tello.video_receive_port != self.default_video_port):
+            success = self.run_step("port {} {}".format(
+                self.tello.tello_state_port, self.tello.video_receive_port),
+                self.ack_timeout)
+        if success:
+            success = self.run_step("streamon", self.ack_timeout)
+            if success and self.on_stream_on is not None:
+                # Warm up video pipeline while taking off.
+                self.on_stream_on()
+
+        if success:
+            success = self.run_step("takeoff", self.takeoff_ack_timeout,
+                self.hovering, "hovering", started=self.takeoff_started)
+            if success:
+                self.takeoff_height = self.state_receiver.state.get("h")
+
+        if success:
+            success = self.run_step("up {}".format(self.climb_distance),
+                self.ack_timeout, self.climbed, "climbed",
+                started=self.climb_started)
+
+        msg = "Startup sequence {} in {:.1f} s."
+        msg = msg.format("completed" if success else "finished with errors",
+            time.monotonic() - start_time)
+        self.tello.log_message(self.info_tag, msg)
+
+        return success
+
+    def run_step(self, comm, ack_timeout, condition=None,
+            condition_name=None, started=None):
+
+        """Sends command, waits for its acknowledgement and state condition.
+
+        IN:
+            comm - str - command to be sent to Tello.
+            ack_timeout - float - maximum waiting time for "ok" in seconds.
+            condition - callable - takes Tello state, returns bool.
+            condition_name - str - condition name for logging.
+            started - callable - takes Tello state, returns True if the
+                movement was started. Given for movements, which are resent
+                only if fresh state shows they were not, and which count as
+                acknowledged if state shows they were. None for idempotent
+                commands.
+        OUT:
+            success - bool - False if command was not acknowledged or
+                condition was not met in time.
+        """
+
+        step_start = time.monotonic()
+        response = None
+        for attempt in range(1 + self.ack_retries):
+            if (attempt > 0 and started is not None
+                    and not self.not_started(started)):
+                break
+            response = self.tello.send_command_and_wait(comm, ack_timeout)
+            if response is not None:
+                break
+        if (response is None and started is not None
+                and started(self.state_receiver.state)):
+            # Acknowledgement is late or lost, Tello is moving.
+            msg = "Command '{}' not acknowledged, but started."
+            self.tello.log_message(self.info_tag, msg.format(comm))
+        elif response != "ok":
+            msg = "Command '{}' not acknowledged, response: {}"
+            self.tello.log_message(self.err_tag, msg.format(comm, response))
+            return False
+
+        if condition is not None and not self.state_receiver.wait_for(
+                condition, self.state_timeout):
+            msg = "Condition '{}' after '{}' not met in {} s."
+            self.tello.log_message(self.err_tag, msg.format(condition_name,
+                comm, self.state_timeout))
+            return False
+
+        msg = "'{}' done in {:.2f} s."
+        self.tello.log_message(self.info_tag,
+            msg.format(comm, time.monotonic() - step_start))
+
+        return True
+
+    def not_started(self, started):
+
+        """Checks if fresh Tello state shows that a movement was not
+        started, so that it can be resent.
+
+        IN:
+            started - callable - takes Tello state, returns bool.
+        OUT:
+            not_started - bool - False if the movement was started or there
+                is no fresh state.
+        """
+
+        state_time = self.state_receiver.state_time
+        if (state_time is None
+                or time.monotonic() - state_time > self.max_state_age):
+            return False
+
+        return not started(self.state_receiver.state)
+
+    def takeoff_started(self, state):
+
+        """Checks if Tello left the ground or is climbing."""
+
+        return (state.get("h", 0) >= self.height_tolerance
+            or abs(state.get("vgz", 0)) > self.max_settled_speed)
+
+    def climb_started(self, state):
+
+        """Checks if Tello climbed above takeoff height or is climbing."""
+
+        takeoff_height = self.takeoff_height or 0
+
+        return (state.get("h", 0) >= takeoff_height + self.height_tolerance
+            or abs(state.get("vgz", 0)) > self.max_settled_speed)
+
+    def settled(self, state):
+
+        """Checks if Tello speed on all axes is settled."""
+
+        return all(abs(state.get(key, 0)) <= self.max_settled_speed
+            for key in ("vgx", "vgy", "vgz"))
+
+    def hovering(self, state):
+
+        """Checks if Tello took off and is hovering."""
+
+        return state.get("h", 0) >= self.min_hover_height and self.settled(state)
+
+    def climbed(self, state):
+
+        """Checks if Tello reached target height after climbing."""
+
+        takeoff_height = self.takeoff_height or 0
+        target_height = takeoff_height + self.climb_distance
+        height_reached = state.get("h", 0) >= target_height - self.height_tolerance
+
+        return height_reached and self.settled(state)
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
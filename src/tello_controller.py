@@ -1,8 +1,14 @@
 """Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
 
+import datetime
 import threading
+import time
 
+from async_logger import AsyncLogger
+from detector_pool import DetectorPool
 from follow_me import Tello
+from metrics import MetricsRegistry, MetricsServer
+from sampling_profiler import SamplingProfiler
 
 
 class TelloFollowMeController():
@@ -12,25 +18,67 @@ class TelloFollowMeController():
     Responsible for:
         - initizlizing Tello command and video stream threads;
         - initializing keyboard input thread;
-        - displaying Tello video stream."""
+        - displaying Tello video stream.
+
+    Several drones (e.g. Tello EDU in station mode) can be run from one
+    process. Every drone needs its own IP and local command, state and video
+    ports; face detection of all drones then runs on a shared DetectorPool.
+
+    Without console, no keyboard input thread is started and the program is
+    stopped by setting running to False (e.g. in soak tests).
+
+    If binary_log_path is given, high-frequency events (detected faces) of
+    all drones are written to it (see async_logger.read_events())."""
 
     #--------------------------------------------------------------------------
     # Init
     #--------------------------------------------------------------------------
 
-    def __init__(self):
-        self._tello = Tello()
+    def __init__(self, drones=None, metrics_port=9100, console=True,
+            binary_log_path=None, detector_params=None):
 
         # Logging
         self._info_tag = "TELLO_COMMANDER_INFO: "
         self._err_tag = "TELLO_COMMANDER_ERR: "
+        self._logger = AsyncLogger(binary_path=binary_log_path)
+
+        # Metrics, served at http://127.0.0.1:<metrics_port>/metrics.
+        self._metrics = MetricsRegistry()
+        self._metrics_server = None
+        if metrics_port is not None:
+            try:
+                self._metrics_server = MetricsServer(self.metrics,
+                    port=metrics_port)
+            except OSError as e:
+                # Flying without metrics endpoint is fine.
+                self.log_message(self.err_tag,
+                    "Metrics endpoint not started: {}".format(e))
+
+        # Drones: Tello keyword arguments (name, tello_ip, mac_ip,
+        # comm_receive_port, tello_state_port, video_receive_port, video_url)
+        # of every drone.
+        if drones is None:
+            drones = [{}]
+        # Detection parameters (e.g. tiled mode) of the detector pool, and of
+        # drones not given their own.
+        self._detector_params = detector_params
+        self._detector_pool = None
+        if len(drones) > 1:
+            self._detector_pool = DetectorPool(detector_params=detector_params)
+        self._tellos = self.start_tellos(drones)
+
+        # Profiling, toggled from the console. Nothing is sampled while off.
+        self._profiler = SamplingProfiler()
+        self._profiled_stages = ("video_receive", "detect_face", "comm_handle")
 
         # Threads
         self._running = True
         self._input_thread_running = True
-        # Start reading input from terminal.
-        self._input_thread = threading.Thread(target=self.get_input)
-        self.input_thread.start()
+        self._input_thread = None
+        if console:
+            # Start reading input from terminal.
+            self._input_thread = threading.Thread(target=self.get_input)
+            self.input_thread.start()
 
     #--------------------------------------------------------------------------
     # End Init
@@ -40,10 +88,26 @@ class TelloFollowMeController():
     # Getters
     #--------------------------------------------------------------------------
 
+    @property
+    def tellos(self):
+        return self._tellos
+
     @property
     def tello(self):
-        return self._tello
-    
+        return self.tellos[0]
+
+    @property
+    def detector_pool(self):
+        return self._detector_pool
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def profiled_stages(self):
+        return self._profiled_stages
+
     @property
     def info_tag(self):
         return self._info_tag
@@ -52,6 +116,18 @@ class TelloFollowMeController():
     def err_tag(self):
         return self._err_tag
 
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def metrics_server(self):
+        return self._metrics_server
+
     @property
     def running(self):
         return self._running
@@ -88,17 +164,89 @@ class TelloFollowMeController():
     # Class Methods
     #--------------------------------------------------------------------------
 
+    def start_tellos(self, drones):
+
+        """Method for starting all drones in parallel.
+
+        Every Tello runs its own startup sequence, so drones take off at the
+        same time.
+
+        IN:
+            drones - list - Tello keyword arguments of every drone.
+        OUT:
+            tellos - list - started Tello objects.
+        """
+
+        tellos = [None] * len(drones)
+
+        def start_tello(i):
+            try:
+                tello_kwargs = dict({"detector_params": self._detector_params},
+                    **drones[i])
+                tellos[i] = Tello(logger=self.logger, metrics=self.metrics,
+                    detector_pool=self.detector_pool, **tello_kwargs)
+            except Exception as e:
+                # Log message.
+                msg = "Drone {} not started: {}".format(drones[i].get("name", i), e)
+                self.log_message(self.err_tag, msg)
+
+        start_threads = [threading.Thread(target=start_tello, args=(i,))
+            for i in range(len(drones))]
+        for start_thread in start_threads:
+            start_thread.start()
+        for start_thread in start_threads:
+            start_thread.join()
+
+        tellos = [tello for tello in tellos if tello is not None]
+        if not tellos:
+            raise RuntimeError("No drone started.")
+
+        return tellos
+
     def get_input(self):
 
         """Method for reading input from keyboard.
         
-        Terminates program when 'q' character is entered."""
+        Terminates program when 'q' character is entered.
+        Stops Tello motors immediately when 'e' character is entered.
+        Starts/stops profiling when 'p' character is entered."""
 
         while self.input_thread_running:
             inp = input()      
             if inp == "q":
                 self.input_thread_running = False
                 self.running = False
+            elif inp == "e":
+                for tello in self.tellos:
+                    tello.emergency()
+            elif inp == "p":
+                self.toggle_profiler()
+
+    def toggle_profiler(self):
+
+        """Method for starting/stopping sampling profiler.
+
+        When stopped, writes collapsed stacks of all threads to
+        tello_profile_<time>.collapsed and logs per-stage timing summary."""
+
+        if not self.profiler.sample_running:
+            self.profiler.start()
+            # Log message.
+            self.log_message(self.info_tag, "Profiling started.")
+            return
+
+        self.profiler.stop()
+        path = "tello_profile_{}.collapsed".format(
+            datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        try:
+            self.profiler.write_collapsed(path)
+            msg = "Profiling stopped, stacks written to {}.\n{}".format(path,
+                self.profiler.summary(self.profiled_stages))
+            # Log message.
+            self.log_message(self.info_tag, msg)
+        except OSError as e:
+            # Log message.
+            self.log_message(self.err_tag, str(e))
 
     def run(self):
 
@@ -109,10 +257,17 @@ class TelloFollowMeController():
 
         while self.running:
             try:
-                self.tello.show_video_frame()
+                if len(self.tellos) == 1:
+                    self.tello.show_video_frame()
+                else:
+                    for tello in self.tellos:
+                        tello.show_video_frame(wait=False)
+                    # Nothing to display yet.
+                    if all(tello.frame is None for tello in self.tellos):
+                        time.sleep(0.1)
             except Exception as e:
                 # Log message.
-                self.log_message(self.err_tag, str(e))
+                self.log_message(self.err_tag, str(e), key=self.err_tag + str(e))
         
         # Log message.
         msg = "Ending program. Tello going to rest. See ya! :)"
@@ -127,25 +282,38 @@ class TelloFollowMeController():
         
     def terminate(self):
         
-        """Method for terminating Tello and keyboard input threads."""
-
-        self.input_thread.join()
-        self.tello.terminate()
+        """Method for terminating Tello, keyboard input, metrics endpoint
+        and logger threads."""
+
+        if self.input_thread is not None:
+            self.input_thread.join()
+        if self.profiler.sample_running:
+            self.toggle_profiler()
+        for tello in self.tellos:
+            tello.terminate()
+        if self.detector_pool is not None:
+            self.detector_pool.terminate()
+        if self.metrics_server is not None:
+            self.metrics_server.terminate()
+        self.logger.terminate()
 
     #--------------------------------------------------------------------------
     # End Terminators
     #--------------------------------------------------------------------------
 
-    def log_message(self, tag, msg):
+    def log_message(self, tag, msg, key=None):
         
         """Method for logging messages.
+
+        Puts message into the logger queue, never blocks on I/O.
         
         IN:
             tag - str - message tag (TELLO_COMMANDER_INFO or
                 TELLO_COMMANDER_ERR)
-            msg - str - message to be logged."""
+            msg - str - message to be logged.
+            key - str - rate limiting key, not rate limited if None."""
 
-        print(tag + msg)
+        self.logger.log(tag, msg, key)
 
     #--------------------------------------------------------------------------
     # End Class Methods
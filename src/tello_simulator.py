@@ -0,0 +1,340 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import argparse
+import socket
+import threading
+import time
+
+
+class TelloSimulator():
+
+    """Class simulating Tello command and state interface on a local address.
+
+    Responsible for:
+        - answering SDK commands on UDP port 8889 after the simulated time
+          the movement takes, like Tello does;
+        - keeping simulated height, yaw and speeds;
+        - sending state messages to the client's state port 10 times per
+          second.
+
+    Video is not simulated: Tello clients read a video file or camera
+    instead (Tello video_url argument).
+    Several simulators can run at once on different loopback addresses
+    (127.0.0.1, 127.0.0.2, ...), like Tello EDU drones in station mode.
+    Linux routes all of 127.0.0.0/8 to loopback; macOS only has 127.0.0.1
+    until aliases are added (sudo ifconfig lo0 alias 127.0.0.2 up).
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, tello_ip="127.0.0.1", comm_port=8889, time_scale=1.0):
+        # Communication
+        self._tello_ip = tello_ip
+        self._comm_port = comm_port
+        self._comm_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.comm_sock.bind((self.tello_ip, self.comm_port))
+        self.comm_sock.settimeout(0.5)
+        self._state_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # State is sent from the simulated drone's address.
+        self.state_sock.bind((self.tello_ip, 0))
+        # Client address, known after the first command.
+        self._client_ip = None
+        self._state_port = 8890
+        self._video_port = 11111
+
+        # Simulated flight
+        self._time_scale = time_scale # simulated movement time multiplier
+        self._speed = 100 # cm/s
+        self._yaw_rate = 90 # deg/s
+        self._takeoff_height = 80 # cm
+        self._height = 0 # cm
+        self._yaw = 0 # deg
+        self._velocity = (0, 0, 0) # dm/s
+        self._battery = 100 # %
+        self._flying = False
+        self._commands_received = 0
+
+        # Threads
+        self._running = True
+        self._comm_thread = threading.Thread(target=self.comm_handle,
+            daemon=True)
+        self._state_thread = threading.Thread(target=self.state_send,
+            daemon=True)
+        self.comm_thread.start()
+        self.state_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def tello_ip(self):
+        return self._tello_ip
+
+    @property
+    def comm_port(self):
+        return self._comm_port
+
+    @property
+    def comm_sock(self):
+        return self._comm_sock
+
+    @property
+    def state_sock(self):
+        return self._state_sock
+
+    @property
+    def client_ip(self):
+        return self._client_ip
+
+    @property
+    def state_port(self):
+        return self._state_port
+
+    @property
+    def video_port(self):
+        return self._video_port
+
+    @property
+    def time_scale(self):
+        return self._time_scale
+
+    @property
+    def height(self):
+        return self._height
+
+    @property
+    def yaw(self):
+        return self._yaw
+
+    @property
+    def flying(self):
+        return self._flying
+
+    @property
+    def commands_received(self):
+        return self._commands_received
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def comm_thread(self):
+        return self._comm_thread
+
+    @property
+    def state_thread(self):
+        return self._state_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @running.setter
+    def running(self, new_running):
+        self._running = new_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def comm_handle(self):
+
+        """Method for command receiving thread."""
+
+        while self.running:
+            try:
+                comm, address = self.comm_sock.recvfrom(1024)
+            except OSError:
+                # Timeout or socket closed on termination.
+                continue
+            self._client_ip = address[0]
+            self._commands_received += 1
+            response = self.execute(comm.decode(encoding="utf-8").strip())
+            try:
+                self.comm_sock.sendto(response.encode(encoding="utf-8"),
+                    address)
+            except OSError:
+                pass
+
+    def execute(self, comm):
+
+        """Simulates command execution.
+
+        IN:
+            comm - str - SDK command.
+        OUT:
+            response - str - "ok", "error" or the requested value.
+        """
+
+        words = comm.split()
+        if not words:
+            return "error"
+        name, args = words[0], words[1:]
+        try:
+            args = [int(arg) for arg in args]
+        except ValueError:
+            return "error"
+
+        if name in ("command", "streamon", "streamoff"):
+            return "ok"
+        if name == "battery?":
+            return str(self._battery)
+        if name == "port" and len(args) == 2:
+            self._state_port, self._video_port = args
+            return "ok"
+        if name == "emergency":
+            self._flying = False
+            self._height = 0
+            return "ok"
+        if name == "takeoff":
+            self.move(0, 0, self._takeoff_height)
+            self._flying = True
+            return "ok"
+        if not self.flying:
+            return "error"
+        if name == "land":
+            self.move(0, 0, -self.height)
+            self._flying = False
+            return "ok"
+        if name in ("up", "down") and len(args) == 1:
+            self.move(0, 0, args[0] if name == "up" else -args[0])
+            return "ok"
+        if name in ("forward", "back", "left", "right") and len(args) == 1:
+            forward = {"forward": 1, "back": -1}.get(name, 0) * args[0]
+            left = {"left": 1, "right": -1}.get(name, 0) * args[0]
+            self.move(forward, left, 0)
+            return "ok"
+        if name in ("cw", "ccw") and len(args) == 1:
+            self.rotate(args[0] if name == "cw" else -args[0])
+            return "ok"
+        if name == "go" and len(args) == 4:
+            self.move(args[0], args[1], args[2])
+            return "ok"
+
+        return "error"
+
+    def move(self, forward, left, up):
+
+        """Simulates translation, blocking for the time it takes.
+
+        IN:
+            forward, left, up - int - distance in cm on every axis."""
+
+        distance = max(abs(forward), abs(left), abs(up))
+        duration = distance / self._speed
+        if duration > 0:
+            self._velocity = tuple(int(10 * value / distance * self._speed / 100)
+                for value in (forward, left, up))
+            time.sleep(duration * self.time_scale)
+        self._height = max(0, self.height + up)
+        self._velocity = (0, 0, 0)
+
+    def rotate(self, degrees):
+
+        """Simulates rotation, blocking for the time it takes.
+
+        IN:
+            degrees - int - clockwise rotation in degrees."""
+
+        time.sleep(abs(degrees) / self._yaw_rate * self.time_scale)
+        self._yaw = (self.yaw + degrees + 180) % 360 - 180
+
+    def state_message(self):
+
+        """Builds Tello state message."""
+
+        vgx, vgy, vgz = self._velocity
+        return ("pitch:0;roll:0;yaw:{};vgx:{};vgy:{};vgz:{};templ:60;"
+            "temph:62;tof:{};h:{};bat:{};baro:0.00;time:0;agx:0.00;"
+            "agy:0.00;agz:-1000.00;\r\n").format(int(self.yaw), vgx, vgy, vgz,
+            int(self.height) + 10, int(self.height), self._battery)
+
+    def state_send(self):
+
+        """Method for state sending thread."""
+
+        while self.running:
+            if self.client_ip is not None:
+                try:
+                    self.state_sock.sendto(
+                        self.state_message().encode(encoding="utf-8"),
+                        (self.client_ip, self.state_port))
+                except OSError:
+                    pass
+            time.sleep(0.1)
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for stopping simulator threads and closing sockets."""
+
+        self.running = False
+        self.comm_thread.join()
+        self.state_thread.join()
+        self.comm_sock.close()
+        self.state_sock.close()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    # Multi-drone follow-me demo against local simulated drones.
+
+    from tello_controller import TelloFollowMeController
+
+    parser = argparse.ArgumentParser(
+        description="Run follow-me controller against simulated drones.")
+    parser.add_argument("--drones", type=int, default=3,
+        help="number of simulated drones")
+    parser.add_argument("--video", default="0",
+        help="video file or camera index used as every drone's video stream")
+    args = parser.parse_args()
+
+    video_url = int(args.video) if args.video.isdigit() else args.video
+    simulators = []
+    drones = []
+    for i in range(args.drones):
+        tello_ip = "127.0.0.{}".format(i + 1)
+        try:
+            simulators.append(TelloSimulator(tello_ip))
+        except OSError as e:
+            for simulator in simulators:
+                simulator.terminate()
+            parser.exit(1, "Cannot bind {}: {}. On macOS, add a loopback "
+                "alias first: sudo ifconfig lo0 alias {} up\n".format(tello_ip,
+                e, tello_ip))
+        drones.append({"name": "sim{}".format(i + 1), "tello_ip": tello_ip,
+            "mac_ip": "127.0.0.1", "comm_receive_port": 9003 + i,
+            "tello_state_port": 8890 + 10*i, "video_receive_port": 11111 + 10*i,
+            "video_url": video_url})
+
+    tello_follow_me_controller = TelloFollowMeController(drones=drones)
+    tello_follow_me_controller.run()
+
+    for simulator in simulators:
+        simulator.terminate()
@@ -0,0 +1,183 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import socket
+import threading
+import time
+
+
+class TelloStateReceiver():
+
+    """Class for receiving Tello state broadcast.
+
+    Tello sends its state, e.g. "pitch:0;roll:0;yaw:0;vgx:0;vgy:0;vgz:0;...;
+    h:0;bat:87;...", to UDP port 8890 about 10 times per second.
+
+    Responsible for:
+        - receiving and parsing Tello state in a background thread;
+        - waiting for state conditions, e.g. height reached."""
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, mac_ip="0.0.0.0", tello_state_port=8890,
+            tello_ip=None):
+        # Communication
+        self._mac_ip = mac_ip
+        # Messages from other addresses are ignored, if set.
+        self._tello_ip = tello_ip
+        self._tello_state_port = tello_state_port
+        self._state_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.state_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.state_sock.bind((self.mac_ip, self.tello_state_port))
+        self.state_sock.settimeout(1)
+
+        # State
+        self._state = {}
+        self._state_time = None
+        self._state_condition = threading.Condition()
+
+        # Threads
+        self._state_receive_running = True
+        self._state_receive_thread = threading.Thread(
+            target=self.state_receive, daemon=True)
+        self.state_receive_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def mac_ip(self):
+        return self._mac_ip
+
+    @property
+    def tello_ip(self):
+        return self._tello_ip
+
+    @property
+    def tello_state_port(self):
+        return self._tello_state_port
+
+    @property
+    def state_sock(self):
+        return self._state_sock
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def state_time(self):
+        return self._state_time
+
+    @property
+    def state_condition(self):
+        return self._state_condition
+
+    @property
+    def state_receive_running(self):
+        return self._state_receive_running
+
+    @property
+    def state_receive_thread(self):
+        return self._state_receive_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @state_receive_running.setter
+    def state_receive_running(self, new_state_receive_running):
+        self._state_receive_running = new_state_receive_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def state_receive(self):
+
+        """Method for Tello state receiving thread."""
+
+        while self.state_receive_running:
+            try:
+                state_msg, address = self.state_sock.recvfrom(1024)
+            except OSError:
+                # Timeout or socket closed on termination.
+                continue
+            if self.tello_ip is not None and address[0] != self.tello_ip:
+                continue
+            state = self.parse_state(state_msg.decode(encoding="utf-8"))
+            with self.state_condition:
+                self._state = state
+                self._state_time = time.monotonic()
+                self.state_condition.notify_all()
+
+    def parse_state(self, state_msg):
+
+        """Parses Tello state message.
+
+        IN:
+            state_msg - str - "key:value;key:value;..." state message.
+        OUT:
+            state - dict - state values converted to float where possible.
+        """
+
+        state = {}
+        for field in state_msg.strip().split(";"):
+            if ":" not in field:
+                continue
+            key, value = field.split(":", 1)
+            try:
+                state[key] = float(value)
+            except ValueError:
+                state[key] = value
+
+        return state
+
+    def wait_for(self, predicate, timeout):
+
+        """Waits until Tello state satisfies the predicate.
+
+        IN:
+            predicate - callable - takes state dict, returns bool.
+            timeout - float - maximum waiting time in seconds.
+        OUT:
+            satisfied - bool - False if timeout expired.
+        """
+
+        with self.state_condition:
+            return self.state_condition.wait_for(
+                lambda: bool(self.state) and predicate(self.state), timeout)
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for terminating Tello state receiving thread."""
+
+        self.state_receive_running = False
+        self.state_sock.close()
+        self.state_receive_thread.join()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
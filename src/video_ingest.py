@@ -0,0 +1,526 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import collections
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+class LazyFrame():
+
+    """Decoded frame whose luma plane is used for detection as it is.
+
+    Face detection works on grayscale, which is the Y plane of the decoded
+    YUV picture. Limited range luma (16-235) differs from the grayscale
+    conversion of BGR only by scale and offset, and cascades normalize every
+    window by its variance, so faces are detected the same. Only luma is
+    resized; BGR is converted (and resized in the
+    same pass) on the first bgr() call, for frames which are displayed or
+    recorded. Face bounding boxes drawn on the frame before that are drawn
+    after conversion.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, video_frame):
+        self._video_frame = video_frame
+        self._width = video_frame.width
+        self._height = video_frame.height
+        if video_frame.format.name.startswith(("yuv", "nv")):
+            plane = video_frame.planes[0]
+            luma = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)
+            self._luma = luma[:self._height, :self._width]
+        else:
+            self._luma = video_frame.to_ndarray(format="gray")
+
+        # (draw function, face_rect) to be drawn after conversion.
+        self._annotations = []
+        self._bgr = None
+        self._lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def luma(self):
+        return self._luma
+
+    @property
+    def shape(self):
+        return (self._height, self._width, 3)
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def resize(self, size):
+
+        """Resizes luma; BGR will be converted at this size.
+
+        IN:
+            size - tuple - (width, height).
+        OUT:
+            self - LazyFrame - the resized frame.
+        """
+
+        self._width, self._height = size
+        self._luma = cv2.resize(self.luma, size)
+
+        return self
+
+    def annotate(self, draw, face_rect):
+
+        """Draws face bounding box on the BGR frame, when it is converted.
+
+        IN:
+            draw - callable - takes BGR image and face_rect, draws in place.
+            face_rect - numpy.ndarray - [top_left_x, top_left_y, width,
+                height] of the face."""
+
+        with self._lock:
+            if self._bgr is not None:
+                draw(self._bgr, face_rect)
+            else:
+                self._annotations.append((draw, face_rect))
+
+    def bgr(self):
+
+        """Returns BGR frame, converting it on the first call.
+
+        OUT:
+            bgr - numpy.ndarray - BGR frame with annotations drawn.
+        """
+
+        with self._lock:
+            if self._bgr is None:
+                self._bgr = self._video_frame.reformat(width=self._width,
+                    height=self._height, format="bgr24").to_ndarray()
+                for draw, face_rect in self._annotations:
+                    draw(self._bgr, face_rect)
+                # Decoded picture is not needed anymore.
+                self._video_frame = None
+
+        return self._bgr
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
+
+
+class VideoIngest():
+
+    """Class for reading decoded frames from Tello video stream, a video
+    file or a camera.
+
+    Responsible for:
+        - decoding with PyAV, returning LazyFrames in luma mode and BGR
+          frames otherwise;
+        - reading BGR frames with OpenCV when neither luma mode nor frame
+          skipping is on, PyAV is not installed or the source is a camera
+          index;
+        - skipping decoding while behind real time (PyAV);
+        - playing video files in real time, in a loop.
+
+    Lag behind real time is the growth of (arrival time - frame timestamp)
+    over its minimum. Nominal timestamps of raw streams drift from the
+    sender's clock, so the minimum rises by up to offset_decay per second,
+    and it is reset whenever demuxing had to wait for a packet (or a video
+    file packet was not due yet), as nothing is queued then. When lag
+    exceeds max_lag, the decoder skips disposable non-reference frames; when
+    it exceeds keyframe_lag, it decodes keyframes only, jumping from
+    keyframe to keyframe. Full decoding resumes (at a keyframe, after a
+    jump) once lag falls under resume_lag. OpenCV decodes every frame, so
+    nothing is skipped without PyAV.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, video_url, luma_only=False, skip_late_frames=True,
+            max_lag=0.2, keyframe_lag=0.5, resume_lag=0.05,
+            offset_decay=0.05):
+        self._video_url = video_url
+        # PyAV decodes in luma mode or to skip frames while late.
+        self._use_av = ((luma_only or skip_late_frames) and av is not None
+            and not isinstance(video_url, int))
+        self._luma_only = luma_only and self._use_av
+        self._skip_late_frames = skip_late_frames and self._use_av
+        self._video_cap = None
+        self._container = None
+        self._stream = None
+        self._packets = None
+        self._decoded_frames = collections.deque()
+        self._reopen_interval = 1 # s
+        # Waiting for a stream to open or to send data gives up after this,
+        # so a stopped stream does not block reading (and termination).
+        self._stream_timeout = 2 # s
+
+        # Frame timestamps, from packets or, if the stream has none (raw
+        # H.264 over UDP), from packet count and frame rate.
+        self._nominal_frame_interval = 1 / 30 # s
+        self._packet_count = 0
+
+        # Decode skipping
+        self._max_lag = max_lag # s
+        self._keyframe_lag = keyframe_lag # s
+        self._resume_lag = resume_lag # s
+        self._offset_decay = offset_decay # s/s
+        # Demuxing longer than this waited for a packet to arrive.
+        self._caught_up_wait = 0.005 # s
+        self._min_offset = None
+        self._last_offset_time = None
+        self._lag = 0 # s
+        self._skip_mode = "DEFAULT"
+        self._catchup_count = 0
+        self._keyframe_jump_count = 0
+        self._skipped_frame_count = 0
+
+        # Video files are played in real time, in a loop.
+        self._frame_interval = None
+        self._next_frame_time = None
+        self._first_timestamp = None
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def video_url(self):
+        return self._video_url
+
+    @property
+    def use_av(self):
+        return self._use_av
+
+    @property
+    def luma_only(self):
+        return self._luma_only
+
+    @property
+    def skip_late_frames(self):
+        return self._skip_late_frames
+
+    @property
+    def video_cap(self):
+        return self._video_cap
+
+    @property
+    def container(self):
+        return self._container
+
+    @property
+    def stream(self):
+        return self._stream
+
+    @property
+    def max_lag(self):
+        return self._max_lag
+
+    @property
+    def keyframe_lag(self):
+        return self._keyframe_lag
+
+    @property
+    def resume_lag(self):
+        return self._resume_lag
+
+    @property
+    def offset_decay(self):
+        return self._offset_decay
+
+    @property
+    def lag(self):
+        return self._lag
+
+    @property
+    def skip_mode(self):
+        return self._skip_mode
+
+    @property
+    def catchup_count(self):
+        return self._catchup_count
+
+    @property
+    def keyframe_jump_count(self):
+        return self._keyframe_jump_count
+
+    @property
+    def skipped_frame_count(self):
+        return self._skipped_frame_count
+
+    @property
+    def frame_interval(self):
+        return self._frame_interval
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def open(self):
+
+        """Opens video source.
+
+        OUT:
+            opened - bool - False if the source could not be opened.
+        """
+
+        is_file = isinstance(self.video_url, str) and os.path.isfile(self.video_url)
+        fps = 0
+        if self.use_av:
+            try:
+                self._container = av.open(self.video_url,
+                    timeout=self._stream_timeout)
+            except av.FFmpegError:
+                return False
+            self._stream = self.container.streams.video[0]
+            self._packets = self.container.demux(self.stream)
+            if self.stream.average_rate:
+                fps = float(self.stream.average_rate)
+                self._nominal_frame_interval = 1 / fps
+        else:
+            params = ()
+            if hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+                params = (cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,
+                    int(self._stream_timeout*1000),
+                    cv2.CAP_PROP_READ_TIMEOUT_MSEC,
+                    int(self._stream_timeout*1000))
+            self._video_cap = cv2.VideoCapture(self.video_url, cv2.CAP_ANY,
+                params)
+            self.video_cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)
+            fps = self.video_cap.get(cv2.CAP_PROP_FPS)
+
+        if is_file:
+            self._frame_interval = 1 / fps if fps > 0 else 1 / 30
+            self._next_frame_time = time.perf_counter()
+
+        return True
+
+    def read(self):
+
+        """Reads the next decoded frame.
+
+        OUT:
+            (frame_res, frame) - tuple:
+                frame_res - bool - False if no frame was decoded.
+                frame - LazyFrame in luma mode, numpy.ndarray BGR frame
+                    otherwise, None if no frame was decoded.
+        """
+
+        frame_res, frame = self.read_frame()
+        if self.frame_interval is not None:
+            if not frame_res:
+                # Rewind video file.
+                self.rewind()
+                frame_res, frame = self.read_frame()
+            if not self.use_av:
+                self.wait_for_frame_time()
+
+        return frame_res, frame
+
+    def read_frame(self):
+
+        """Reads the next frame from the backend."""
+
+        if self.use_av:
+            return self.read_av()
+        return self.video_cap.read()
+
+    def read_av(self):
+
+        """Decodes the next frame with PyAV, skipping frames while late."""
+
+        if self.container is None:
+            if not self.open():
+                time.sleep(self._reopen_interval)
+                return False, None
+
+        try:
+            while not self._decoded_frames:
+                demux_start = time.perf_counter()
+                try:
+                    packet = next(self._packets)
+                except av.FFmpegError:
+                    # Stream timed out or broke, reopened on the next read.
+                    if self.frame_interval is None:
+                        self.close_container()
+                    return False, None
+                caught_up = (time.perf_counter() - demux_start
+                    > self._caught_up_wait)
+                timestamp = self.packet_timestamp(packet)
+                if timestamp is not None:
+                    if self.frame_interval is not None:
+                        # Video file packets arrive like live stream ones.
+                        caught_up = self.wait_for_frame_time(timestamp)
+                    if self.skip_late_frames:
+                        self.update_skip_mode(timestamp, packet.is_keyframe,
+                            caught_up)
+                frames = self.stream.codec_context.decode(packet)
+                if not frames and packet.size and self.skip_mode != "DEFAULT":
+                    self._skipped_frame_count += 1
+                for frame in frames:
+                    if self.luma_only:
+                        self._decoded_frames.append(LazyFrame(frame))
+                    else:
+                        self._decoded_frames.append(
+                            frame.to_ndarray(format="bgr24"))
+        except StopIteration:
+            # Video files are rewound, live streams reopened.
+            if self.frame_interval is None:
+                self.close_container()
+            return False, None
+        except av.FFmpegError:
+            # Corrupted packet, decoding continues with the next one.
+            return False, None
+
+        return True, self._decoded_frames.popleft()
+
+    def packet_timestamp(self, packet):
+
+        """Returns packet timestamp in seconds, None for flush packets."""
+
+        if not packet.size:
+            return
+        self._packet_count += 1
+        if packet.pts is not None and packet.time_base is not None:
+            return float(packet.pts * packet.time_base)
+        return self._packet_count * self._nominal_frame_interval
+
+    def update_skip_mode(self, timestamp, is_keyframe, caught_up=False):
+
+        """Updates lag behind real time and decoder skip mode.
+
+        IN:
+            timestamp - float - timestamp of the packet being decoded.
+            is_keyframe - bool - True if the packet holds a keyframe.
+            caught_up - bool - True if demuxing waited for the packet, so
+                no packets are queued behind it."""
+
+        now = time.perf_counter()
+        offset = now - timestamp
+        if self._min_offset is None or caught_up:
+            self._min_offset = offset
+        else:
+            self._min_offset = min(offset, self._min_offset
+                + self.offset_decay*(now - self._last_offset_time))
+        self._last_offset_time = now
+        self._lag = offset - self._min_offset
+
+        skip_mode = self.skip_mode
+        if self.lag > self.keyframe_lag:
+            skip_mode = "NONKEY"
+        elif self.lag > self.max_lag and skip_mode == "DEFAULT":
+            skip_mode = "NONREF"
+        elif self.lag < self.resume_lag and (skip_mode == "NONREF"
+                or (skip_mode == "NONKEY" and is_keyframe)):
+            # After keyframe jumps, frames after a keyframe need it decoded.
+            skip_mode = "DEFAULT"
+        if skip_mode == self.skip_mode:
+            return
+
+        if self.skip_mode == "DEFAULT":
+            self._catchup_count += 1
+        if skip_mode == "NONKEY":
+            self._keyframe_jump_count += 1
+        self._skip_mode = skip_mode
+        self.stream.codec_context.skip_frame = skip_mode
+
+    def wait_for_frame_time(self, timestamp=None):
+
+        """Waits until the next frame is due, when playing a video file.
+
+        Packets are due at their timestamp, so frames skipped in luma mode
+        do not slow playback down.
+
+        IN:
+            timestamp - float - packet timestamp, None to wait for one frame
+                interval.
+        OUT:
+            waited - bool - True if the frame was not due yet.
+        """
+
+        if timestamp is None:
+            self._next_frame_time += self.frame_interval
+            due_time = self._next_frame_time
+        else:
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._next_frame_time = time.perf_counter()
+            due_time = self._next_frame_time + timestamp - self._first_timestamp
+        wait_time = due_time - time.perf_counter()
+        time.sleep(max(0, wait_time))
+
+        return wait_time > 0
+
+    def rewind(self):
+
+        """Restarts video file from the beginning."""
+
+        if self.use_av:
+            self.container.seek(0)
+            self._packets = self.container.demux(self.stream)
+            self._decoded_frames.clear()
+            self._packet_count = 0
+            # Timestamps start over.
+            self._min_offset = None
+            self._first_timestamp = None
+        else:
+            self.video_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def close_container(self):
+
+        """Closes PyAV container, so that the stream is reopened."""
+
+        if self.container is not None:
+            self.container.close()
+        self._container = None
+        self._decoded_frames.clear()
+        self._packet_count = 0
+        self._min_offset = None
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def release(self):
+
+        """Method for closing video source."""
+
+        if self.video_cap is not None:
+            self.video_cap.release()
+        self.close_container()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------
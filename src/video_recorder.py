@@ -0,0 +1,325 @@
+"""Copyright 2022 Yaroslava Tkachuk. All rights reserved."""
+
+import collections
+import datetime
+import os
+import threading
+import time
+
+import cv2
+
+from video_ingest import LazyFrame
+
+
+class VideoRecorder():
+
+    """Class for recording video frames to disk in the background.
+
+    Responsible for:
+        - accepting frames without blocking the caller, through a bounded
+          queue which drops the oldest frame when full;
+        - encoding frames on its own thread;
+        - rotating chunk files by size or duration;
+        - counting encoded and dropped frames.
+
+    Frames arrive at the detection rate, not at a fixed one. Every frame is
+    written once per fps slot passed since the previous one, by its submit
+    time, so the video plays back in real time. Frames arriving within the
+    same slot are dropped, and pauses longer than a second are shortened to
+    one.
+
+    If a chunk file cannot be opened, on_error(msg) is called and frames are
+    dropped until a new chunk is opened, at most once per second.
+    """
+
+    #--------------------------------------------------------------------------
+    # Init
+    #--------------------------------------------------------------------------
+
+    def __init__(self, output_dir, prefix="tello", fps=30, fourcc="mp4v",
+            queue_size=30, max_chunk_bytes=200*1024*1024,
+            max_chunk_seconds=300, on_error=None):
+        self._output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        # Chunk files are named <prefix>_<start time>_<chunk number>.mp4.
+        self._prefix = prefix
+        self._fps = fps
+        self._fourcc = fourcc
+        self._on_error = on_error
+
+        # Chunk rotation.
+        self._max_chunk_bytes = max_chunk_bytes
+        self._max_chunk_seconds = max_chunk_seconds # s
+        self._video_writer = None
+        self._chunk_path = None
+        self._chunk_start = None
+        self._chunk_size = None
+        # Frame slots of 1/fps s passed since chunk start.
+        self._chunk_slots = None
+        self._chunk_count = 0
+        self._reopen_interval = 1 # s
+        self._open_failed_time = None
+
+        # (submit time, frame) waiting for encoding, oldest dropped when full.
+        self._frames = collections.deque()
+        self._queue_size = queue_size
+        self._condition = threading.Condition()
+        self._encoded_count = 0
+        self._dropped_count = 0
+
+        # Threads
+        self._record_running = True
+        self._record_thread = threading.Thread(target=self.record,
+            daemon=True)
+        self.record_thread.start()
+
+    #--------------------------------------------------------------------------
+    # End Init
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Getters
+    #--------------------------------------------------------------------------
+
+    @property
+    def output_dir(self):
+        return self._output_dir
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def fourcc(self):
+        return self._fourcc
+
+    @property
+    def on_error(self):
+        return self._on_error
+
+    @property
+    def max_chunk_bytes(self):
+        return self._max_chunk_bytes
+
+    @property
+    def max_chunk_seconds(self):
+        return self._max_chunk_seconds
+
+    @property
+    def video_writer(self):
+        return self._video_writer
+
+    @property
+    def chunk_path(self):
+        return self._chunk_path
+
+    @property
+    def chunk_count(self):
+        return self._chunk_count
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def condition(self):
+        return self._condition
+
+    @property
+    def encoded_count(self):
+        return self._encoded_count
+
+    @property
+    def dropped_count(self):
+        return self._dropped_count
+
+    @property
+    def record_running(self):
+        return self._record_running
+
+    @property
+    def record_thread(self):
+        return self._record_thread
+
+    #--------------------------------------------------------------------------
+    # End Getters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Setters
+    #--------------------------------------------------------------------------
+
+    @record_running.setter
+    def record_running(self, new_record_running):
+        self._record_running = new_record_running
+
+    #--------------------------------------------------------------------------
+    # End Setters
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # Class Methods
+    #--------------------------------------------------------------------------
+
+    def submit(self, frame):
+
+        """Puts frame into the encoding queue. Never blocks.
+
+        Drops the oldest queued frame if the queue is full. The frame must
+        not be modified afterwards.
+
+        IN:
+            frame - numpy.ndarray or LazyFrame - BGR frame to be recorded,
+                lazy frames are converted on the recording thread."""
+
+        with self.condition:
+            if len(self.frames) >= self.queue_size:
+                self.frames.popleft()
+                self._dropped_count += 1
+            self.frames.append((time.monotonic(), frame))
+            self.condition.notify()
+
+    def record(self):
+
+        """Method for recording thread.
+
+        Encodes queued frames until stopped and the queue is drained."""
+
+        while True:
+            with self.condition:
+                while self.record_running and not self.frames:
+                    self.condition.wait()
+                if not self.frames:
+                    break
+                timestamp, frame = self.frames.popleft()
+
+            if isinstance(frame, LazyFrame):
+                frame = frame.bgr()
+            if self.chunk_full(timestamp):
+                self.close_chunk()
+            if self.video_writer is None and not self.open_chunk(frame.shape,
+                    timestamp):
+                self._dropped_count += 1
+                continue
+
+            num_of_writes = self.frame_writes(timestamp)
+            if num_of_writes == 0:
+                self._dropped_count += 1
+                continue
+            for _ in range(num_of_writes):
+                self.video_writer.write(frame)
+            self._encoded_count += 1
+
+        self.close_chunk()
+
+    def frame_writes(self, timestamp):
+
+        """Returns how many times a frame is written to match its timestamp.
+
+        IN:
+            timestamp - float - frame submit time.
+        OUT:
+            num_of_writes - int - number of fps slots the frame covers.
+        """
+
+        slots = int((timestamp - self._chunk_start) * self.fps) + 1
+        num_of_writes = min(max(0, slots - self._chunk_slots), self.fps)
+        self._chunk_slots = max(self._chunk_slots, slots)
+
+        return num_of_writes
+
+    def chunk_full(self, timestamp):
+
+        """Checks if the current chunk reached its maximum size or duration.
+
+        IN:
+            timestamp - float - submit time of the next frame."""
+
+        if self.video_writer is None:
+            return False
+        if timestamp - self._chunk_start >= self.max_chunk_seconds:
+            return True
+        # File size is only checked once per second of video.
+        self._chunk_size += 1
+        if self._chunk_size % self.fps == 0:
+            try:
+                return os.path.getsize(self.chunk_path) >= self.max_chunk_bytes
+            except OSError:
+                pass
+        return False
+
+    def open_chunk(self, frame_shape, timestamp):
+
+        """Opens a new chunk file.
+
+        IN:
+            frame_shape - tuple - shape of the recorded frames.
+            timestamp - float - submit time of the chunk's first frame.
+        OUT:
+            opened - bool - False if the file could not be opened.
+        """
+
+        if (self._open_failed_time is not None and time.monotonic()
+                - self._open_failed_time < self._reopen_interval):
+            return False
+
+        start_time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        chunk_path = os.path.join(self.output_dir, "{}_{}_{:03d}.mp4".format(
+            self.prefix, start_time, self.chunk_count + 1))
+        height, width = frame_shape[:2]
+        video_writer = cv2.VideoWriter(chunk_path,
+            cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        if not video_writer.isOpened():
+            video_writer.release()
+            self._open_failed_time = time.monotonic()
+            if self.on_error is not None:
+                self.on_error("Cannot open {} for recording with codec "
+                    "{}.".format(chunk_path, self.fourcc))
+            return False
+
+        self._open_failed_time = None
+        self._chunk_count += 1
+        self._chunk_path = chunk_path
+        self._video_writer = video_writer
+        self._chunk_start = timestamp
+        self._chunk_size = 0
+        self._chunk_slots = 0
+
+        return True
+
+    def close_chunk(self):
+
+        """Closes the current chunk file."""
+
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self._video_writer = None
+
+    #--------------------------------------------------------------------------
+    # Terminators
+    #--------------------------------------------------------------------------
+
+    def terminate(self):
+
+        """Method for encoding queued frames and stopping recording thread."""
+
+        with self.condition:
+            self.record_running = False
+            self.condition.notify()
+        self.record_thread.join()
+
+    #--------------------------------------------------------------------------
+    # End Terminators
+    #--------------------------------------------------------------------------
+
+    #--------------------------------------------------------------------------
+    # End Class Methods
+    #--------------------------------------------------------------------------